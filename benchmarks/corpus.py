@@ -0,0 +1,164 @@
+"""
+Seeded generator for synthetic corpora shaped like the CPR dataset, so the
+pipeline can be benchmarked offline at any size.
+
+Documents have the same attributes as CPRDocument which the pipeline reads
+(document_id, document_name, translated, document_metadata and text_blocks),
+using the record types from src.dataset. A fraction of passages mention the
+title of another document, sometimes alongside its geography name, so that
+both the same-geography and cross-geography checks find mentions.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from src.dataset import CachedDocumentMetadata, CachedTextBlock
+
+GEOGRAPHIES = [
+    ("GBR", "United Kingdom"),
+    ("FRA", "France"),
+    ("DEU", "Germany"),
+    ("USA", "United States"),
+    ("IND", "India"),
+    ("BRA", "Brazil"),
+    ("CHN", "China"),
+    ("ZAF", "South Africa"),
+    ("KEN", "Kenya"),
+    ("MEX", "Mexico"),
+    ("AUS", "Australia"),
+    ("CAN", "Canada"),
+    ("IDN", "Indonesia"),
+    ("NGA", "Nigeria"),
+    ("JPN", "Japan"),
+    ("ARG", "Argentina"),
+    ("EGY", "Egypt"),
+    ("ESP", "Spain"),
+    ("ITA", "Italy"),
+    ("CHL", "Chile"),
+    ("COL", "Colombia"),
+    ("PER", "Peru"),
+    ("VNM", "Viet Nam"),
+    ("PHL", "Philippines"),
+    ("BGD", "Bangladesh"),
+    ("PAK", "Pakistan"),
+    ("NOR", "Norway"),
+    ("SWE", "Sweden"),
+    ("FIN", "Finland"),
+    ("NZL", "New Zealand"),
+    ("EUR", "European Union"),
+]
+
+TITLE_PREFIXES = ["National", "Federal", "Regional", "Strategic", "Integrated", "Sustainable", "Low Carbon"]
+TITLE_TOPICS = [
+    "Climate Change",
+    "Energy",
+    "Renewable Energy",
+    "Adaptation",
+    "Forestry",
+    "Transport",
+    "Water Resources",
+    "Agriculture",
+    "Disaster Risk Reduction",
+    "Green Growth",
+    "Energy Efficiency",
+    "Biodiversity",
+]
+TITLE_INSTRUMENTS = ["Act", "Law", "Strategy", "Policy", "Plan", "Programme", "Decree", "Framework", "Roadmap"]
+
+WORDS = (
+    "the of and to in for on with by as an be is are this that which shall "
+    "government ministry national climate change emissions greenhouse gas energy "
+    "renewable carbon adaptation mitigation sector policy measures implementation "
+    "targets reduction investment finance development sustainable resources water "
+    "forest agriculture transport electricity efficiency (a) (b) (i) 2030, 2050; "
+    "article section paragraph pursuant: authority—report “programme” régime €"
+).split()
+
+
+class SyntheticDocument(NamedTuple):
+    document_id: str
+    document_name: str
+    translated: bool
+    document_metadata: CachedDocumentMetadata
+    text_blocks: list[CachedTextBlock]
+
+
+def make_title(rng: random.Random) -> str:
+    parts = [rng.choice(TITLE_TOPICS), rng.choice(TITLE_INSTRUMENTS)]
+    if rng.random() < 0.6:
+        parts.insert(0, rng.choice(TITLE_PREFIXES))
+    if rng.random() < 0.5:
+        parts.append(str(rng.randint(1990, 2023)))
+    # a serial number keeps most titles distinct, as they are in the real data
+    if rng.random() < 0.8:
+        parts.append(f"No. {rng.randint(1, 9999)}")
+    return " ".join(parts)
+
+
+def generate_corpus(
+    documents: int,
+    passages_per_document: int = 20,
+    mention_rate: float = 0.05,
+    geographies: int = 20,
+    words_per_passage: int = 40,
+    seed: int = 0,
+) -> list[SyntheticDocument]:
+    """
+    Generate a corpus of documents.
+
+    passages_per_document is the mean number of passages in a document, split
+    across text blocks of up to 5 passages. mention_rate is the probability
+    that a passage mentions another document's title, and geographies is the
+    number of distinct geographies, which are skewed so that a few of them hold
+    most of the documents, as in the real data.
+    """
+    rng = random.Random(seed)
+    geography_choices = GEOGRAPHIES[: max(1, min(geographies, len(GEOGRAPHIES)))]
+    geography_weights = [1 / (rank + 1) for rank in range(len(geography_choices))]
+    start = datetime(1990, 1, 1)
+    span = (datetime(2023, 12, 31) - start).days
+
+    titles = [make_title(rng) for _ in range(documents)]
+    document_geographies = rng.choices(geography_choices, geography_weights, k=documents)
+
+    corpus = []
+    family_id = 0
+    for position in range(documents):
+        # families have between one and three documents
+        if position == 0 or rng.random() < 0.5:
+            family_id += 1
+        geography_iso, geography = document_geographies[position]
+
+        passage_count = rng.randint(0, 2 * passages_per_document)
+        passages = []
+        for _ in range(passage_count):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(1, 2 * words_per_passage))]
+            if documents > 1 and rng.random() < mention_rate:
+                cited = rng.randrange(documents)
+                words.insert(rng.randint(0, len(words)), titles[cited])
+                if rng.random() < 0.5:
+                    words.insert(rng.randint(0, len(words)), f"of {document_geographies[cited][1]}")
+            passages.append(" ".join(words))
+
+        text_blocks = []
+        while passages:
+            size = rng.randint(1, 5)
+            text_blocks.append(CachedTextBlock(text=passages[:size]))
+            passages = passages[size:]
+
+        corpus.append(
+            SyntheticDocument(
+                document_id=f"SYNTH.{geography_iso}.{position}.{rng.randint(1000, 9999)}",
+                document_name=titles[position],
+                translated=False,
+                document_metadata=CachedDocumentMetadata(
+                    family_id=f"SYNTH.family.{family_id}",
+                    family_name=f"Family {family_id}",
+                    geography=geography,
+                    geography_iso=geography_iso,
+                    publication_ts=start + timedelta(days=rng.randrange(span)),
+                ),
+                text_blocks=text_blocks,
+            )
+        )
+    return corpus
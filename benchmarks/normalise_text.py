@@ -0,0 +1,50 @@
+"""
+Microbenchmark for src.text.normalise_text and normalise_texts against the
+original four-pass implementation.
+
+    python -m benchmarks.normalise_text
+"""
+import random
+import re
+import timeit
+
+from src.text import normalise_text, normalise_texts
+
+
+def original_normalise_text(input_string: str) -> str:
+    clean_string = re.sub(r"\s+", " ", input_string).strip()
+    clean_string = re.sub(r"[^\x00-\x7F]+", "", clean_string)
+    clean_string = re.sub(r"[^\w\s]", "", clean_string)
+    clean_string = re.sub(r"\([^)]*\)", "", clean_string)
+    return clean_string
+
+
+def make_passages(count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    words = ["climate", "change", "Act", "(2019)", "national", "policy,", "energy.", "émissions", "\n", "plan;"]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(5, 60))) for _ in range(count)]
+
+
+def main(count: int = 50_000, repeat: int = 5):
+    passages = make_passages(count)
+    expected = [original_normalise_text(passage) for passage in passages]
+    assert [normalise_text(passage) for passage in passages] == expected
+    assert normalise_texts(passages) == expected
+
+    timings = {
+        "original": lambda: [original_normalise_text(passage) for passage in passages],
+        "normalise_text": lambda: [normalise_text(passage) for passage in passages],
+        "normalise_texts": lambda: normalise_texts(passages),
+    }
+    baseline = None
+    for name, function in timings.items():
+        seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+        baseline = baseline or seconds
+        print(
+            f"{name:>16}: {seconds * 1000:8.1f} ms for {count:,} passages "
+            f"({count / seconds:,.0f}/s, {baseline / seconds:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
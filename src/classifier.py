@@ -0,0 +1,368 @@
+"""
+Training and evaluating the policy NER model, and linking the titles it finds
+to our documents. These are run from the CLI (see src.cli) or by
+policy_classifier.py, and each stage saves what it produces under data/ so the
+next one can start from there.
+"""
+import json
+from pathlib import Path
+from typing import Optional
+
+from spacy.language import Language
+from spacy.matcher import PhraseMatcher
+from spacy.tokens import Span
+from spacy.training import offsets_to_biluo_tags
+
+from src.dataset import load_documents
+from src.fuzzy import TitleIndex
+from src.mentions import read_mentions
+from src.metrics import metrics
+from src.ner import PredictionCache, iter_passages, load_inference_pipeline, model_fingerprint, predict_entities
+from src.store import dataset_fingerprint, open_passage_store
+from src.text import normalise_text, update_geography
+from src.training import build_corpus, train_ner
+
+# Number of passages in each batch sent through spaCy, and the number of processes to use
+NER_BATCH_SIZE = 256
+NER_PROCESSES = 1
+# The mentions before this fraction are used as the test set, and the rest for training
+TRAIN_RATIO = 0.8
+MODEL_PATH = "policy_ner_model"
+PREDICTION_CACHE_PATH = Path("data/ner_cache.sqlite")
+# Titles found by the model, and the documents they were matched to
+TITLES_PATH = Path("data/titles")
+
+
+@Language.component("match_policy_keywords")
+def match_policy_keywords(doc):
+    phrase_matches = phrase_matcher(doc)
+    entities = []
+
+    # Process matches from the PhraseMatcher
+    for match_id, start, end in phrase_matches:
+        span = Span(doc, start, end, label="POLICY")
+        if not any(span.start >= ent.start and span.end <= ent.end for ent in entities):
+            entities.append(span)
+
+    # Set entities on the Doc
+    doc.ents = entities
+    return doc
+
+def add_policy_matcher(nlp):
+    policy_keywords = ['accord', 'act', 'action', 'constitution',
+                       'decision', 'decree', 'order', 'ordinance', 'directive',
+                       'framework', 'law', 'plan', 'policy', 'programme', 'regulation',
+                       'resolution', 'agenda', 'strategy', 'guideline', 'code', 'rule', 'procedure',
+                       'protocol', 'standard', 'principle', 'requirement']
+
+    # Initialize PhraseMatcher
+    phrase_matcher = PhraseMatcher(nlp.vocab)
+
+    # Convert policy keywords to Doc objects for PhraseMatcher
+    policy_keyword_docs = [nlp(keyword.lower()) for keyword in policy_keywords]
+
+    # Add policy keyword patterns to PhraseMatcher
+    phrase_matcher.add("POLICY_KEYWORDS", None, *policy_keyword_docs)
+
+    return phrase_matcher
+
+def create_training_data(data, store=None):
+    training_data = []
+
+    for entry in data:
+        text = None
+        # Read the normalised text from the passage store where we can
+        if store is not None:
+            text = store.lookup(entry.get("document_id_i", ""), entry.get("found_block", ""))
+        if text is None:
+            text = normalise_text(entry.get("found_block", ""))
+        # the mention carries the name of the document it found, which the store
+        # can't give for ids shared by more than one document
+        policy = normalise_text(entry.get("document_name_j", ""))
+
+        if policy and text:
+            start_idx = text.lower().find(policy.lower())
+            end_idx = start_idx + len(policy)
+
+            # Account for if the same title shows up multiple times in a text block
+            if end_idx < len(text) and text[end_idx].isalnum():
+                continue
+
+            while start_idx != -1:
+                entities = [(start_idx, end_idx, 'POLICY')]
+                annotation = {'entities': entities}
+                training_data.append((text, annotation))
+                start_idx = text.lower().find(policy.lower(), start_idx + 1)
+
+    return training_data
+
+def get_model_data():
+    # Stream the mentions from the JSONL file written by main.py if there is one,
+    # otherwise read them from mentions.json
+    jsonl_file_path = Path("mentions.jsonl")
+    if jsonl_file_path.exists():
+        mentions = read_mentions(jsonl_file_path)
+    else:
+        with open("mentions.json", "r") as json_file:
+            mentions = json.load(json_file)["mentions"]
+
+    # Use the normalised passages from main.py if they're available, and were
+    # built from the dataset the mentions were found in
+    store_path = Path("data/passages/CPR")
+    store = None
+    if (store_path / "index.json").exists():
+        store = open_passage_store(store_path, dataset_fingerprint(load_documents("CPRDocument")))
+
+    # Create training data
+    all_data = create_training_data(mentions, store)
+
+    return all_data
+
+def train_model(train_data):
+    #phrase_matcher = add_policy_matcher(nlp)
+    #nlp.add_pipe("match_policy_keywords", last=True)
+
+    # Serialise the training data once, then train and save the model in minibatches
+    corpus_path = build_corpus(train_data, Path("data/ner_corpus/train.spacy"))
+    train_ner(corpus_path, "policy_ner_model")
+
+def test_model(trained_nlp, stage, test_data, batch_size=256, n_process=1, cache=None):
+
+    total_correct = 0
+    total_predicted = 0
+    total_entities = 0
+    predicted_titles = []
+
+    countries_for_titles = {}
+    predictions = predict_entities(
+        trained_nlp, (text for text, _ in test_data), cache, batch_size, n_process
+    )
+    for (text, annotations), (_, predicted_entities, countries) in zip(test_data, predictions):
+
+        # Check for misaligned entities ('-'), which only needs the tokens
+        bilou_tags = offsets_to_biluo_tags(trained_nlp.make_doc(text), annotations.get("entities", []))
+        if '-' in bilou_tags:
+            print("Misaligned entities in text:", text)
+            print("BILOU tags:", bilou_tags)
+
+        # Extract the ground truth entities
+        ground_truth_entities = {(start, end) for start, end, _ in annotations['entities']}
+
+        for entity in predicted_entities:
+            predicted_titles.append(text[entity[0]:entity[1]])
+            countries_for_titles[text[entity[0]:entity[1]]] = countries
+
+        # Calculate metrics
+        correct_entities = 0
+        for ground_truth_entity in ground_truth_entities:
+            for predicted_entity in predicted_entities:
+                if set(range(ground_truth_entity[0], ground_truth_entity[1])).issubset(
+                        set(range(predicted_entity[0], predicted_entity[1]))):
+                    correct_entities += 1
+                    break  # Stop searching for this ground truth entity once it's found in a predicted entity
+
+        total_correct += correct_entities
+        total_predicted += len(predicted_entities)
+        total_entities += len(ground_truth_entities)
+
+    # Calculate precision, recall, and F1 score
+    precision = total_correct / total_predicted if total_predicted > 0 else 0
+    recall = total_correct / total_entities if total_entities > 0 else 0
+    f1_score = 2 * (precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+
+    print(stage, " Precision:", precision)
+    print(stage, " Recall:", recall)
+    print(stage, " F1 Score:", f1_score)
+
+    return predicted_titles, countries_for_titles
+
+def test_any_document(trained_nlp, data, batch_size=256, n_process=1, cache=None):
+    predicted_titles = []
+    countries_for_titles = {}
+
+    # Stream every passage through the pipeline rather than building a list of them
+    texts = iter_passages(data)
+    for text, predicted_entities, countries in predict_entities(trained_nlp, texts, cache, batch_size, n_process):
+        for entity in predicted_entities:
+            predicted_titles.append(text[entity[0]:entity[1]])
+            countries_for_titles[text[entity[0]:entity[1]]] = countries
+
+    return predicted_titles, countries_for_titles
+
+def fuzzy_match_titles(model_titles, CPR_data, GST_data, countries_check, threshold=90, title_index=None):
+    matched_titles = {}
+
+    easy_match = 0
+    difficult_match = 0
+
+    # Index the unique document names so each title is only scored against
+    # names which could match, GST first so the matches keep the same order
+    if title_index is None:
+        title_index = TitleIndex([GST_data, CPR_data])
+
+    # If matches above 90% in the text block then add it as a potential match
+    all_potential_matches = title_index.match_all(model_titles, threshold)
+
+    # Sort through found titles
+    for model_title in model_titles:
+        potential_matches = list(all_potential_matches[model_title])
+
+        # Sort matches and grab all the matches with the top score
+        if potential_matches:
+            potential_matches.sort(key=lambda x: x[4], reverse=True)
+            # Keep only the top scoring matches
+            top_score = potential_matches[0][4]
+            top_matches = [match for match in potential_matches if match[4] == top_score]
+
+            if len(top_matches) == 1:
+                easy_match += 1
+            else:
+                # Attempt to disambiguate
+                if countries_check[model_title]:
+                    # Check if country name is mentioned in the text block
+                    country_name = list(countries_check[model_title])[0]
+
+                    # Match country name mentioned to country of document
+                    for match in top_matches:
+                        title_geography = match[2]
+                        if title_geography == "nan":
+                            # Try to grab missing geography name with ISO code
+                            new_geography = update_geography(match[1])
+                            title_geography = new_geography
+
+                        if title_geography == country_name:
+                            top_matches = [match]
+                            break
+
+                # Sometimes a country will have a geography iso, but not a name
+                # So here, filter out duplicates, irrespective of country name
+                filtered_top_matches = []
+                seen_tuples = set()
+
+                for top_match in top_matches:
+                    key = top_match[:2] + top_match[3:]
+                    if key not in seen_tuples:
+                        filtered_top_matches.append(top_match)
+                        seen_tuples.add(key)
+
+                top_matches = filtered_top_matches
+
+                if len(top_matches) == 1:
+                    easy_match += 1
+                else:
+                    # Print out those that have not been disambiguated
+                    #print(model_title)
+                    #print(top_matches)
+                    difficult_match += 1
+
+            # Add matches to matches titles
+            matched_titles[model_title] = top_matches
+
+    return matched_titles, easy_match, difficult_match
+
+
+def split_data(all_data):
+    """Split the training data into the (train, test) sets."""
+    train_size = int(len(all_data) * TRAIN_RATIO)
+    return all_data[train_size:], all_data[:train_size]
+
+
+def load_model(model_path: str = MODEL_PATH):
+    """Load the trained model, along with the country NER so both run in one pass."""
+    with metrics.stage("load_model"):
+        trained_nlp = load_inference_pipeline(model_path)
+    # Reuse the predictions from previous runs of the same models
+    prediction_cache = PredictionCache(PREDICTION_CACHE_PATH, model_fingerprint(trained_nlp))
+    return trained_nlp, prediction_cache
+
+
+def save_titles(name: str, titles: list[str], countries_for_titles: dict):
+    TITLES_PATH.mkdir(parents=True, exist_ok=True)
+    with open(TITLES_PATH / f"{name}.json", "w") as f:
+        json.dump(
+            {
+                "titles": titles,
+                "countries": {title: sorted(countries) for title, countries in countries_for_titles.items()},
+            },
+            f,
+        )
+
+
+def load_titles(name: str) -> Optional[tuple[list[str], dict]]:
+    path = TITLES_PATH / f"{name}.json"
+    if not path.exists():
+        return None
+    with open(path) as f:
+        saved = json.load(f)
+    return saved["titles"], {title: set(countries) for title, countries in saved["countries"].items()}
+
+
+def train():
+    """Train the model on the mentions found by the pipeline."""
+    with metrics.stage("load_training_data"):
+        train_data, _ = split_data(get_model_data())
+    with metrics.stage("train_model"):
+        train_model(train_data)
+
+
+def evaluate(batch_size: int = NER_BATCH_SIZE, n_process: int = NER_PROCESSES, trained_nlp=None, cache=None):
+    """Score the model on the test set, and save the titles it finds there for link_titles."""
+    with metrics.stage("load_training_data"):
+        _, test_data = split_data(get_model_data())
+    if trained_nlp is None:
+        trained_nlp, cache = load_model()
+    with metrics.stage("ner_test", counter="ner_passages"):
+        test_titles, test_for_titles = test_model(
+            trained_nlp, "test", test_data, batch_size=batch_size, n_process=n_process, cache=cache
+        )
+    save_titles("test", test_titles, test_for_titles)
+
+
+def link_titles(
+    source: str = "GST",
+    batch_size: int = NER_BATCH_SIZE,
+    n_process: int = NER_PROCESSES,
+    refresh: bool = False,
+    trained_nlp=None,
+    cache=None,
+    title_index: Optional[TitleIndex] = None,
+) -> Optional[TitleIndex]:
+    """
+    Match the titles the model finds in a source to our documents, and save the
+    matches. The source is either "test", for the titles evaluate found in the
+    test set, or "GST", in which case the model is run over every GST passage,
+    unless the titles from a previous run are saved and refresh isn't set.
+    Returns the title index, so it can be reused for another source.
+    """
+    with metrics.stage("load_datasets"):
+        CPR_data = load_documents("CPRDocument")
+        GST_data = load_documents("GSTDocument")
+
+    saved = None if refresh and source == "GST" else load_titles(source)
+    if saved is None:
+        if source != "GST":
+            raise FileNotFoundError(f"No titles saved for {source}, so run evaluate first")
+        if trained_nlp is None:
+            trained_nlp, cache = load_model()
+        with metrics.stage(f"ner_{source}", counter="ner_passages"):
+            saved = test_any_document(trained_nlp, GST_data, batch_size=batch_size, n_process=n_process, cache=cache)
+        save_titles(source, *saved)
+    titles, countries_for_titles = saved
+
+    # Match model outputs with our document titles
+    if title_index is None:
+        with metrics.stage("build_title_index"):
+            title_index = TitleIndex([GST_data, CPR_data])
+    with metrics.stage(f"fuzzy_match_{source}", counter="titles_matched"):
+        matched_titles, easy_matches, difficult_matches = fuzzy_match_titles(
+            titles, CPR_data, GST_data, countries_for_titles, title_index=title_index
+        )
+        metrics.count("titles_matched", len(titles))
+    with open(TITLES_PATH / f"{source}_matches.json", "w") as f:
+        json.dump(matched_titles, f, default=str)
+
+    print(f"Policies found in {source} text:", len(titles))
+    print("Policies matching ours:", easy_matches)
+    print("Policies matching ours, but can't disambiguate:", difficult_matches)
+    print("Policies found, but not matches:", len(titles) - easy_matches - difficult_matches)
+    return title_index
@@ -0,0 +1,223 @@
+"""
+Command line interface to each stage of the project.
+
+    poetry run policies load-dataset
+    poetry run policies find-mentions --incremental
+    poetry run policies find-mentions --shard 0/4
+    poetry run policies merge-shards 4
+    poetry run policies write-graph
+    poetry run policies run --pipelined
+    poetry run policies export-graph
+    poetry run policies train
+    poetry run policies evaluate
+    poetry run policies link-titles --source GST
+
+Each stage reads what the stages before it saved to disk, so any of them can be
+rerun on its own. Only this module is imported to parse the arguments, and
+each command imports what it needs (spaCy, neomodel, cpr_data_access and so
+on) when it runs, so --help returns straight away.
+"""
+import argparse
+import sys
+from pathlib import Path
+from typing import Optional
+
+
+def load_dataset(args):
+    from src.linking import load_dataset
+
+    load_dataset(args.version, args.refresh)
+
+
+def find_mentions(args):
+    if args.shard is not None:
+        from src.linking import find_shard_mentions
+
+        find_shard_mentions(*args.shard, args.processes)
+        return
+
+    from src.linking import find_mentions
+
+    find_mentions(args.incremental, args.processes)
+
+
+def merge_shards(args):
+    from src.linking import merge_shards
+
+    merge_shards(args.shards, write=not args.skip_graph)
+
+
+def write_graph(args):
+    from src.linking import write_graph
+
+    write_graph(args.full)
+
+
+def export_graph(args):
+    from src.linking import export_graph
+
+    export_graph(args.output, args.top)
+
+
+def run(args):
+    from src.linking import run
+
+    run(args.incremental, args.pipelined, args.processes, args.refresh)
+
+
+def train(args):
+    from src.classifier import train
+
+    train()
+
+
+def evaluate(args):
+    from src.classifier import evaluate
+
+    evaluate(args.batch_size, args.n_process)
+
+
+def link_titles(args):
+    from src.classifier import link_titles
+
+    link_titles(args.source, args.batch_size, args.n_process, args.refresh)
+
+
+def shard(text: str) -> tuple[int, int]:
+    """Parse a shard given as k/N, where k is from 0 to N - 1."""
+    try:
+        shard, shards = map(int, text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected k/N, eg. 0/4, not {text!r}")
+    if shards < 1 or not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError(f"k has to be from 0 to N - 1, not {text!r}")
+    return shard, shards
+
+
+REFRESH_HELP = "Download the datasets again, even if they're cached, to pick up a new release"
+PROFILE_HELP = "Sample the call stack throughout the run and add the hottest functions to the metrics report"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="policies", description="Find policies mentioned in other policies."
+    )
+    parser.add_argument("--profile", action="store_true", help=PROFILE_HELP)
+    # --profile can also be given after the command (as main.py passes it), where
+    # it's suppressed by default so that it doesn't reset one given before it
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--profile", action="store_true", default=argparse.SUPPRESS, help=PROFILE_HELP)
+    commands = parser.add_subparsers(title="commands", required=True, metavar="command")
+
+    command = commands.add_parser("load-dataset", parents=[common], help="Download and cache the datasets and normalise their passages")
+    command.add_argument(
+        "--version",
+        help="Dataset version to load, which the other commands then use too (default: the latest)",
+    )
+    command.add_argument("--refresh", action="store_true", help=REFRESH_HELP)
+    command.set_defaults(handler=load_dataset)
+
+    command = commands.add_parser("find-mentions", parents=[common], help="Find mentions between documents and save them to mentions.jsonl")
+    mode = command.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only update the documents which have changed since the last run",
+    )
+    mode.add_argument(
+        "--shard",
+        type=shard,
+        metavar="k/N",
+        help="Only find the mentions in shard k (from 0) of N, split by document_id, and save them "
+        "to data/shards to be merged with merge-shards",
+    )
+    command.add_argument("--processes", type=int, help="Number of processes to match with (default: every core)")
+    command.set_defaults(handler=find_mentions)
+
+    command = commands.add_parser(
+        "merge-shards", parents=[common], help="Merge the mentions found by find-mentions --shard and write them to neo4j"
+    )
+    command.add_argument("shards", type=int, help="Number of shards the documents were split into")
+    command.add_argument(
+        "--skip-graph",
+        action="store_true",
+        help="Only merge the mentions into mentions.jsonl, and leave writing them to neo4j to write-graph",
+    )
+    command.set_defaults(handler=merge_shards)
+
+    command = commands.add_parser("write-graph", parents=[common], help="Write the documents and saved mentions to neo4j")
+    command.add_argument(
+        "--full",
+        action="store_true",
+        help="Rebuild the whole graph, rather than only updating the documents which have changed",
+    )
+    command.set_defaults(handler=write_graph)
+
+    command = commands.add_parser(
+        "export-graph", parents=[common], help="Export the saved mentions to a local CSR graph for analysis without neo4j"
+    )
+    command.add_argument("--output", type=Path, help="Directory to save the graph to (default: data/graph)")
+    command.add_argument("--top", type=int, default=10, help="Number of top-ranked documents to print")
+    command.set_defaults(handler=export_graph)
+
+    command = commands.add_parser("run", parents=[common], help="Load the datasets, find mentions and write the graph in one go")
+    command.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only update the documents which have changed since the last run",
+    )
+    command.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Write documents and mentions to neo4j while the mentions are still being found",
+    )
+    command.add_argument("--refresh", action="store_true", help=REFRESH_HELP)
+    command.add_argument("--processes", type=int, help="Number of processes to match with (default: every core)")
+    command.set_defaults(handler=run)
+
+    command = commands.add_parser("train", parents=[common], help="Train the policy NER model on the saved mentions")
+    command.set_defaults(handler=train)
+
+    for name, handler, help in [
+        ("evaluate", evaluate, "Score the policy NER model on the test set"),
+        ("link-titles", link_titles, "Match the titles the policy NER model finds to our documents"),
+    ]:
+        command = commands.add_parser(name, parents=[common], help=help)
+        command.add_argument("--batch-size", type=int, default=256, help="Passages in each batch sent through spaCy")
+        command.add_argument("--n-process", type=int, default=1, help="Number of processes to run spaCy with")
+        command.set_defaults(handler=handler)
+    command.add_argument(
+        "--source",
+        choices=["GST", "test"],
+        default="GST",
+        help="Link the titles found in the GST documents, or those evaluate found in the test set",
+    )
+    command.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Run the model over the GST documents again, even if their titles have been saved",
+    )
+    return parser
+
+
+def main(argv: Optional[list[str]] = None):
+    args = build_parser().parse_args(argv)
+
+    from src.metrics import metrics
+
+    # time each stage of the command and count what it does, for the metrics report
+    name = args.handler.__name__
+    run = name
+    if getattr(args, "shard", None) is not None:
+        # shards are usually started at the same time, so each needs its own report
+        run += "-shard-{}-of-{}".format(*args.shard)
+    metrics.reset(run)
+    if args.profile:
+        metrics.start_profiler()
+    args.handler(args)
+    options = {key: value for key, value in vars(args).items() if key != "handler"}
+    print(f"Wrote metrics to {metrics.write_report(command=name, **options)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import json
+import shutil
+from array import array
+from collections.abc import Sequence
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from src.records import CachedDocumentMetadata, CachedTextBlock, DocumentRecord
+from src.store import map_file
+
+CACHE_VERSION = 1
+
+DATASETS_PATH = Path("data/datasets")
+# the dataset version which is loaded when none is given, as chosen by load-dataset
+CURRENT_VERSION_PATH = DATASETS_PATH / "version.json"
+
+METADATA_COLUMNS = ["family_id", "family_name", "geography", "geography_iso", "publication_ts"]
+
+
+# columns with few distinct values, which are shared between documents rather
+# than loaded as a separate string or datetime for each of them
+SHARED_COLUMNS = ["family_name", "geography", "geography_iso"]
+
+
+class CachedPassages(Sequence):
+    """A document's passages in a DatasetCache, which are only read from disk when they're accessed."""
+
+    __slots__ = ("cache", "start", "end")
+
+    def __init__(self, cache: "DatasetCache", start: int, end: int):
+        self.cache = cache
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self.cache.passage(self.start + i) for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("passage index out of range")
+        return self.cache.passage(self.start + position)
+
+    def __iter__(self):
+        for position in range(self.start, self.end):
+            yield self.cache.passage(position)
+
+
+class CachedDocument(DocumentRecord):
+    """A DocumentRecord for a document in a DatasetCache, whose passages are read from disk lazily."""
+
+    __slots__ = ("cache", "position")
+
+    def __init__(self, cache: "DatasetCache", position: int):
+        columns = cache.columns
+        self.cache = cache
+        self.position = position
+        self.document_id = columns["document_id"][position]
+        self.document_name = columns["document_name"][position]
+        self.translated = bool(columns["translated"][position])
+        self.has_metadata = bool(columns["has_metadata"][position])
+        self.family_id = columns["family_id"][position]
+        self.family_name = columns["family_name"][position]
+        self.geography = columns["geography"][position]
+        self.geography_iso = columns["geography_iso"][position]
+        self.publication_ts = columns["publication_ts"][position]
+        self.passages = CachedPassages(
+            cache,
+            cache.block_offsets[cache.document_offsets[position]],
+            cache.block_offsets[cache.document_offsets[position + 1]],
+        )
+        self.block_lengths = None
+
+    @property
+    def text_blocks(self) -> list[CachedTextBlock]:
+        return self.cache.text_blocks(self.position)
+
+
+class DatasetCache:
+    """
+    A dataset stored as columns on disk.
+
+    The document fields and metadata are stored as JSON columns in
+    columns.json, so they can be loaded without reading any text. Passages are
+    concatenated into a memory-mapped file, addressed by three arrays of
+    offsets: the byte range of each passage, the range of passages in each
+    text block and the range of text blocks in each document.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / "columns.json") as f:
+            columns = json.load(f)
+        if columns.pop("version") != CACHE_VERSION:
+            raise ValueError(f"Unsupported dataset cache version in {self.path}")
+        for name in SHARED_COLUMNS:
+            shared_values = {}
+            columns[name] = [shared_values.setdefault(value, value) for value in columns[name]]
+        timestamps = {
+            timestamp: datetime.fromisoformat(timestamp)
+            for timestamp in set(columns["publication_ts"])
+            if timestamp is not None
+        }
+        columns["publication_ts"] = [timestamps.get(timestamp) for timestamp in columns["publication_ts"]]
+        columns["translated"] = array("B", columns["translated"])
+        columns["has_metadata"] = array("B", columns["has_metadata"])
+        self.columns = columns
+        self.passages_map = map_file(self.path / "passages.bin")
+        self.passage_offsets = map_file(self.path / "passage_offsets.bin").cast("Q")
+        self.block_offsets = map_file(self.path / "block_offsets.bin").cast("Q")
+        self.document_offsets = map_file(self.path / "document_offsets.bin").cast("Q")
+
+    @classmethod
+    def build(cls, path: Path, dataset) -> "DatasetCache":
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        columns = {
+            name: [] for name in ["document_id", "document_name", "translated", "has_metadata"]
+        }
+        columns.update({name: [] for name in METADATA_COLUMNS})
+        passage_offsets, block_offsets, document_offsets = (array("Q", [0]) for _ in range(3))
+
+        with open(path / "passages.bin", "wb") as f:
+            for document in dataset:
+                columns["document_id"].append(document.document_id)
+                columns["document_name"].append(document.document_name)
+                columns["translated"].append(document.translated)
+                metadata = document.document_metadata
+                columns["has_metadata"].append(metadata is not None)
+                for name in METADATA_COLUMNS:
+                    value = getattr(metadata, name, None)
+                    if isinstance(value, datetime):
+                        value = value.isoformat()
+                    columns[name].append(value)
+
+                for block in document.text_blocks:
+                    for passage in block.text:
+                        passage_offsets.append(passage_offsets[-1] + f.write(passage.encode("utf-8")))
+                    block_offsets.append(len(passage_offsets) - 1)
+                document_offsets.append(len(block_offsets) - 1)
+
+        for name, offsets in [
+            ("passage_offsets", passage_offsets),
+            ("block_offsets", block_offsets),
+            ("document_offsets", document_offsets),
+        ]:
+            with open(path / f"{name}.bin", "wb") as f:
+                offsets.tofile(f)
+        # the columns are written last, so an interrupted build never looks complete
+        with open(path / "columns.json", "w") as f:
+            json.dump({"version": CACHE_VERSION, **columns}, f)
+        return cls(path)
+
+    def __len__(self) -> int:
+        return len(self.columns["document_id"])
+
+    def __getitem__(self, position: int) -> CachedDocument:
+        return CachedDocument(self, position)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield CachedDocument(self, position)
+
+    def metadata(self, position: int) -> Optional[CachedDocumentMetadata]:
+        if not self.columns["has_metadata"][position]:
+            return None
+        return CachedDocumentMetadata(*(self.columns[name][position] for name in METADATA_COLUMNS))
+
+    def passage(self, position: int) -> str:
+        start, end = self.passage_offsets[position], self.passage_offsets[position + 1]
+        return str(self.passages_map[start:end], "utf-8")
+
+    def text_blocks(self, position: int) -> list[CachedTextBlock]:
+        blocks = []
+        for block in range(self.document_offsets[position], self.document_offsets[position + 1]):
+            passages = range(self.block_offsets[block], self.block_offsets[block + 1])
+            blocks.append(CachedTextBlock([self.passage(passage) for passage in passages]))
+        return blocks
+
+
+def current_version() -> Optional[str]:
+    """The dataset version chosen by the last load-dataset, or None for the latest."""
+    if not CURRENT_VERSION_PATH.exists():
+        return None
+    with open(CURRENT_VERSION_PATH) as f:
+        return json.load(f)["version"]
+
+
+def set_current_version(version: Optional[str]):
+    """Choose the dataset version which every stage loads when they're not given one."""
+    CURRENT_VERSION_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(CURRENT_VERSION_PATH, "w") as f:
+        json.dump({"version": version}, f)
+
+
+def replace_cache(path: Path, dataset) -> DatasetCache:
+    """
+    Build a cache next to the one at path and then swap it in, so the previous
+    cache stays complete until the new one is, and processes which already
+    have it open keep reading the old files.
+    """
+    partial_path = path.with_name(f"{path.name}.partial")
+    old_path = path.with_name(f"{path.name}.old")
+    shutil.rmtree(partial_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+    DatasetCache.build(partial_path, dataset)
+    if path.exists():
+        path.rename(old_path)
+    partial_path.rename(path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return DatasetCache(path)
+
+
+def load_documents(document_type, version: Optional[str] = None, refresh: bool = False) -> DatasetCache:
+    """
+    Load a dataset from its cache on disk, or download it from huggingface and
+    cache it if it hasn't been downloaded before. Each document type and dataset
+    version is cached separately, and if no version is given, the current one
+    (see set_current_version) is loaded. The document type can be given by name
+    (eg. "CPRDocument"), so that cached datasets can be loaded without
+    importing cpr_data_access at all.
+
+    A cached dataset is never checked against huggingface, so the latest
+    version is only downloaded again if refresh is set.
+    """
+    if version is None:
+        version = current_version()
+    type_name = document_type if isinstance(document_type, str) else document_type.__name__
+    cache_path = DATASETS_PATH / type_name / (version or "latest")
+    if not refresh and (cache_path / "columns.json").exists():
+        return DatasetCache(cache_path)
+
+    # only import the data access library when there's something to download
+    from cpr_data_access import models
+    from cpr_data_access.models import Dataset
+
+    if isinstance(document_type, str):
+        document_type = getattr(models, document_type)
+
+    dataset = Dataset(document_type, cdn_domain="cdn.climatepolicyradar.org")
+    if version is not None:
+        dataset = dataset.from_huggingface(version=version)
+    else:
+        dataset = dataset.from_huggingface()
+    return replace_cache(cache_path, dataset)
@@ -0,0 +1,104 @@
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from fuzzywuzzy import fuzz
+
+from src.records import document_record
+from src.titles import TitleTable
+
+
+def ngrams(text: str, n: int) -> Counter:
+    return Counter(text[i : i + n] for i in range(len(text) - n + 1))
+
+
+class TitleIndex:
+    """
+    Character n-gram index over the unique document names in some datasets, for
+    finding the names which fuzz.ratio scores at or above a threshold against a
+    title without scoring every name.
+
+    Candidates are filtered with bounds that can never reject a name which would
+    pass the threshold, and only the remaining candidates are scored, with
+    fuzz.ratio itself, so the matches are the same as scoring every name.
+    fuzz.ratio is 2M / T, where M is at most the length of the longest common
+    subsequence of the two strings and T is their combined length. This limits
+    how different their lengths can be, and bounds their edit distance k by
+    T - 2M. Strings within edit distance k share at least
+    max(len) - n + 1 - k * n of their n-grams.
+    """
+
+    def __init__(self, datasets: Iterable, n: int = 2):
+        self.n = n
+        # (document_name, geography_iso, geography, publication_ts) for each
+        # distinct document, in the order the documents are first seen
+        self.entries = []
+        seen_entries = set()
+        # each distinct lowercased name, with the ids of its entries as the
+        # targets of its postings, so a name is only scored once however many
+        # documents carry it
+        self.titles = TitleTable()
+        for dataset in datasets:
+            for document in map(document_record, dataset):
+                entry = (
+                    document.document_name,
+                    document.geography_iso,
+                    document.geography,
+                    document.publication_ts,
+                )
+                if entry in seen_entries:
+                    continue
+                seen_entries.add(entry)
+                self.titles.add(document.document_name.lower(), document, target=len(self.entries))
+                self.entries.append(entry)
+        self.names = self.titles.titles
+        self.name_entries = self.titles.targets
+
+        self.names_by_length = defaultdict(list)
+        self.postings = defaultdict(list)
+        for name_id, name in enumerate(self.names):
+            self.names_by_length[len(name)].append(name_id)
+            for gram, count in ngrams(name, n).items():
+                self.postings[gram].append((name_id, count))
+
+    def candidates(self, title: str, threshold: float) -> list[int]:
+        """Return the ids of the names which could score at or above the threshold against a lowercased title."""
+        # fuzz.ratio rounds the score, so anything from threshold - 0.5 could pass
+        ratio = (threshold - 0.5) / 100
+        if not title or ratio <= 0:
+            return list(range(len(self.names)))
+
+        shared = defaultdict(int)
+        for gram, count in ngrams(title, self.n).items():
+            for name_id, name_count in self.postings.get(gram, []):
+                shared[name_id] += min(count, name_count)
+
+        candidates = []
+        for length, name_ids in self.names_by_length.items():
+            total = len(title) + length
+            if 2 * min(len(title), length) < ratio * total:
+                continue
+            max_distance = int(total * (1 - ratio) + 1e-9)
+            min_shared = max(len(title), length) - self.n + 1 - max_distance * self.n
+            for name_id in name_ids:
+                if min_shared <= 0 or shared.get(name_id, 0) >= min_shared:
+                    candidates.append(name_id)
+        return candidates
+
+    def match(self, title: str, threshold: float) -> list[tuple]:
+        """
+        Return (document_name, geography_iso, geography, publication_ts, score)
+        for each distinct document whose name scores at or above the threshold,
+        in the order the documents were indexed.
+        """
+        title = title.lower()
+        matches = []
+        for name_id in self.candidates(title, threshold):
+            score = fuzz.ratio(title, self.names[name_id])
+            if score >= threshold:
+                matches += [(entry_id, score) for entry_id in self.name_entries[name_id]]
+        matches.sort()
+        return [self.entries[entry_id] + (score,) for entry_id, score in matches]
+
+    def match_all(self, titles: Iterable[str], threshold: float) -> dict[str, list[tuple]]:
+        """Match a batch of titles, scoring each distinct title once."""
+        return {title: self.match(title, threshold) for title in dict.fromkeys(titles)}
@@ -0,0 +1,292 @@
+"""
+A local copy of the mentions graph in compressed sparse row (CSR) form, so it
+can be analysed in-process without going through neo4j.
+
+Documents and families are given dense integer ids, in the order they're first
+seen. The MENTIONS edges from each document are indices[indptr[k]:indptr[k + 1]]
+(and the same for the edges into each document, with in_indptr and
+in_indices), and the BELONGS_TO edges are document_family, which holds the
+family of each document or -1 if it has none. Each array is saved as a .npy
+file, and loaded memory-mapped, so even a large graph opens instantly and is
+only read from disk as it's used.
+"""
+import json
+from array import array
+from pathlib import Path
+from typing import Iterable, NamedTuple, Optional, Union
+
+import numpy as np
+
+from src.mentions import read_mentions
+from src.records import document_record
+
+GRAPH_PATH = Path("data/graph")
+ARRAYS = ["indptr", "indices", "in_indptr", "in_indices", "document_family"]
+
+
+class Adjacency(NamedTuple):
+    """The edges of a graph in CSR form, with the number of edges each one stands for if they've been collapsed."""
+
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: Optional[np.ndarray] = None
+
+    @property
+    def nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def neighbours(self, nodes: np.ndarray) -> np.ndarray:
+        """Return the neighbours of all of the nodes, concatenated, in one vectorised gather."""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        starts = self.indptr[nodes]
+        lengths = self.indptr[nodes + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.empty(0, dtype=self.indices.dtype)
+        # the position of each edge is the start of its node's range plus its offset within it
+        offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return self.indices[np.repeat(starts, lengths) + offsets]
+
+
+def csr(sources: np.ndarray, targets: np.ndarray, nodes: int) -> Adjacency:
+    """Build the CSR adjacency of some edges, sorting and dropping any duplicates."""
+    edges = np.unique(sources.astype(np.int64) * nodes + targets)
+    sources, targets = np.divmod(edges, nodes)
+    indptr = np.zeros(nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=nodes), out=indptr[1:])
+    return Adjacency(indptr, targets.astype(np.int32))
+
+
+def mention_ends(mention: Union[tuple, dict]) -> tuple[str, str, str]:
+    if isinstance(mention, dict):
+        return mention["document_id_i"], mention["document_id_j"], mention["document_name_j"]
+    return mention[0], mention[1], mention[2]
+
+
+class CitationGraph:
+    """
+    The MENTIONS and BELONGS_TO edges between documents and families in CSR
+    form, with vectorised degrees, family-collapsed adjacency, k-hop
+    neighbourhoods and PageRank.
+    """
+
+    def __init__(
+        self,
+        document_ids: list[str],
+        document_names: list[str],
+        family_ids: list[str],
+        document_family: np.ndarray,
+        mentions: Adjacency,
+        mentioned_by: Adjacency,
+    ):
+        self.document_ids = document_ids
+        self.document_names = document_names
+        self.family_ids = family_ids
+        self.document_family = document_family
+        self.mentions = mentions
+        self.mentioned_by = mentioned_by
+        self.positions = {document_id: position for position, document_id in enumerate(document_ids)}
+
+    def __len__(self) -> int:
+        return len(self.document_ids)
+
+    @property
+    def edges(self) -> int:
+        return len(self.mentions.indices)
+
+    @classmethod
+    def from_mentions(cls, mentions: Iterable[Union[tuple, dict]], documents: Iterable = ()) -> "CitationGraph":
+        """
+        Build the graph from mentions, either the tuples found by the matcher
+        or the records in mentions.jsonl, and the documents they're between.
+        Every document is a node even if it isn't mentioned, and gives the
+        families for the BELONGS_TO edges. Documents which are only known from
+        the mentions have no family. Repeated mentions between two documents
+        are one edge, as they are in neo4j.
+        """
+        positions = {}
+        document_names = []
+        family_positions = {}
+        document_family = array("i")
+
+        def position(document_id: str, document_name: str = "", family_id: Optional[str] = None) -> int:
+            if document_id not in positions:
+                positions[document_id] = len(positions)
+                document_names.append(document_name)
+                if family_id is not None and family_id not in family_positions:
+                    family_positions[family_id] = len(family_positions)
+                document_family.append(-1 if family_id is None else family_positions[family_id])
+            return positions[document_id]
+
+        for document in map(document_record, documents):
+            position(document.document_id, document.document_name, document.family_id)
+
+        sources = array("i")
+        targets = array("i")
+        for mention in mentions:
+            id_i, id_j, name_j = mention_ends(mention)
+            sources.append(position(id_i))
+            targets.append(position(id_j, name_j))
+            if not document_names[targets[-1]]:
+                document_names[targets[-1]] = name_j
+
+        nodes = len(positions)
+        sources = np.frombuffer(sources, dtype=np.int32)
+        targets = np.frombuffer(targets, dtype=np.int32)
+        return cls(
+            list(positions),
+            document_names,
+            list(family_positions),
+            np.frombuffer(document_family, dtype=np.int32).copy(),
+            csr(sources, targets, nodes),
+            csr(targets, sources, nodes),
+        )
+
+    @classmethod
+    def from_mentions_file(cls, path: Path, documents: Iterable = ()) -> "CitationGraph":
+        """Build the graph from a mentions.jsonl or mentions.json file."""
+        path = Path(path)
+        if path.suffix == ".json":
+            with open(path) as f:
+                mentions = json.load(f)["mentions"]
+        else:
+            mentions = read_mentions(path)
+        return cls.from_mentions(mentions, documents)
+
+    def save(self, path: Path = GRAPH_PATH):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        arrays = {
+            "indptr": self.mentions.indptr,
+            "indices": self.mentions.indices,
+            "in_indptr": self.mentioned_by.indptr,
+            "in_indices": self.mentioned_by.indices,
+            "document_family": self.document_family,
+        }
+        for name in ARRAYS:
+            np.save(path / f"{name}.npy", arrays[name])
+        # written last, so an interrupted export never looks complete
+        with open(path / "nodes.json", "w") as f:
+            json.dump(
+                {
+                    "document_ids": self.document_ids,
+                    "document_names": self.document_names,
+                    "family_ids": self.family_ids,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path: Path = GRAPH_PATH) -> "CitationGraph":
+        """Open a saved graph, with its arrays memory-mapped read-only."""
+        path = Path(path)
+        with open(path / "nodes.json") as f:
+            nodes = json.load(f)
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in ARRAYS}
+        return cls(
+            nodes["document_ids"],
+            nodes["document_names"],
+            nodes["family_ids"],
+            arrays["document_family"],
+            Adjacency(arrays["indptr"], arrays["indices"]),
+            Adjacency(arrays["in_indptr"], arrays["in_indices"]),
+        )
+
+    def out_degrees(self) -> np.ndarray:
+        """The number of documents each document mentions."""
+        return self.mentions.degrees()
+
+    def in_degrees(self) -> np.ndarray:
+        """The number of documents which mention each document."""
+        return self.mentioned_by.degrees()
+
+    def family_adjacency(self, self_loops: bool = False) -> Adjacency:
+        """
+        Collapse the graph to families, with an edge between two families if a
+        document in one mentions a document in the other. Each edge is weighted
+        by the number of document edges it stands for. Documents without a
+        family are left out, as are mentions within a family unless self_loops
+        is set.
+        """
+        families = len(self.family_ids)
+        sources = np.repeat(self.document_family, self.out_degrees())
+        targets = self.document_family[self.mentions.indices]
+        keep = (sources >= 0) & (targets >= 0)
+        if not self_loops:
+            keep &= sources != targets
+        edges, weights = np.unique(
+            sources[keep].astype(np.int64) * families + targets[keep], return_counts=True
+        )
+        sources, targets = np.divmod(edges, families)
+        indptr = np.zeros(families + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=families), out=indptr[1:])
+        return Adjacency(indptr, targets.astype(np.int32), weights)
+
+    def neighbourhood(self, document_id: str, hops: int = 1, direction: str = "out") -> list[str]:
+        """
+        Return the ids of the documents within some number of hops of a
+        document, following the edges out of it ("out"), into it ("in") or
+        both, nearest first.
+        """
+        adjacencies = {
+            "out": [self.mentions],
+            "in": [self.mentioned_by],
+            "both": [self.mentions, self.mentioned_by],
+        }[direction]
+        start = self.positions[document_id]
+        seen = np.zeros(len(self), dtype=bool)
+        seen[start] = True
+        frontier = np.array([start])
+        found = []
+        for _ in range(hops):
+            neighbours = np.unique(
+                np.concatenate([adjacency.neighbours(frontier) for adjacency in adjacencies])
+            )
+            frontier = neighbours[~seen[neighbours]]
+            if not frontier.size:
+                break
+            seen[frontier] = True
+            found.append(frontier)
+        if not found:
+            return []
+        return [self.document_ids[position] for position in np.concatenate(found)]
+
+    def pagerank(self, damping: float = 0.85, tolerance: float = 1e-10, max_iterations: int = 100) -> np.ndarray:
+        """
+        Return the PageRank of each document, by power iteration. The rank of
+        documents which don't mention any others is spread over every document.
+        """
+        nodes = len(self)
+        if not nodes:
+            return np.empty(0)
+        out_degrees = self.out_degrees()
+        sources = np.repeat(np.arange(nodes), out_degrees)
+        dangling = out_degrees == 0
+        # the share of a document's rank passed along each of its edges
+        share = np.divide(1.0, out_degrees, out=np.zeros(nodes), where=~dangling)
+        ranks = np.full(nodes, 1.0 / nodes)
+        for _ in range(max_iterations):
+            passed = np.bincount(
+                self.mentions.indices, weights=(ranks * share)[sources], minlength=nodes
+            )
+            new_ranks = (1 - damping) / nodes + damping * (passed + ranks[dangling].sum() / nodes)
+            converged = np.abs(new_ranks - ranks).sum() < tolerance
+            ranks = new_ranks
+            if converged:
+                break
+        return ranks
+
+    def top(self, scores: np.ndarray, n: int = 10) -> list[tuple[str, str, float]]:
+        """Return the (document_id, document_name, score) of the n documents with the highest scores."""
+        n = min(n, len(scores))
+        if not n:
+            return []
+        best = np.argpartition(-scores, n - 1)[:n]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [
+            (self.document_ids[position], self.document_names[position], scores[position].item())
+            for position in best
+        ]
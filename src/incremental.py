@@ -0,0 +1,88 @@
+import json
+from hashlib import blake2b
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from src.matching import find_mentions_parallel
+from src.records import document_record
+
+
+def document_fingerprint(document) -> str:
+    """Hash every field of a document which the graph or the matching depends on."""
+    document = document_record(document)
+    digest = blake2b(digest_size=16)
+    fields = [document.document_id, document.document_name]
+    if document.has_metadata:
+        fields += [
+            document.family_id,
+            document.family_name,
+            document.geography,
+            document.geography_iso,
+            document.publication_ts,
+        ]
+    digest.update(json.dumps(fields, default=str).encode("utf-8"))
+    for passage in document.passages:
+        digest.update(passage.encode("utf-8") + b"\x01")
+    return digest.hexdigest()
+
+
+def build_manifest(datasets: dict, cross_geography: bool) -> dict:
+    return {
+        "cross_geography": cross_geography,
+        "datasets": {
+            name: {document.document_id: document_fingerprint(document) for document in dataset}
+            for name, dataset in datasets.items()
+        },
+    }
+
+
+def load_manifest(path: Path) -> Optional[dict]:
+    if not Path(path).exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(path: Path, manifest: dict):
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+
+def diff_manifests(previous: dict, current: dict, name: str) -> tuple[set[str], set[str]]:
+    """Return the ids of the documents in a dataset which are new or changed, and those which were removed."""
+    previous_fingerprints = previous["datasets"].get(name, {})
+    current_fingerprints = current["datasets"][name]
+    changed = {
+        document_id
+        for document_id, fingerprint in current_fingerprints.items()
+        if previous_fingerprints.get(document_id) != fingerprint
+    }
+    removed = set(previous_fingerprints) - set(current_fingerprints)
+    return changed, removed
+
+
+def find_changed_mentions(dataset, changed_ids: set[str], store=None, collect: bool = True, **kwargs) -> Optional[set]:
+    """
+    Find the mentions which involve a changed document, either as the document
+    doing the mentioning or as the document being mentioned. Any other keyword
+    arguments are passed to find_mentions_parallel, and as with it, None is
+    returned if collect is False.
+    """
+    if not changed_ids:
+        return set() if collect else None
+    changed = [document for document in dataset if document.document_id in changed_ids]
+    unchanged = [document for document in dataset if document.document_id not in changed_ids]
+    mentions = find_mentions_parallel(changed, dataset, store, collect=collect, **kwargs)
+    # only the changed titles need to be searched for in the unchanged documents,
+    # and these mentions are in different documents so they can't repeat the others
+    unchanged_mentions = find_mentions_parallel(unchanged, changed, store, collect=collect, **kwargs)
+    if not collect:
+        return None
+    return mentions | unchanged_mentions
+
+
+def unaffected_mentions(previous_mentions: Iterable[dict], affected_ids: set[str]) -> Iterator[dict]:
+    """Yield the mentions from a previous run which don't involve an affected document."""
+    for mention in previous_mentions:
+        if mention["document_id_i"] not in affected_ids and mention["document_id_j"] not in affected_ids:
+            yield mention
@@ -0,0 +1,426 @@
+import os
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from itertools import chain
+from multiprocessing import get_context
+from typing import Callable, Iterable, Iterator, Optional
+
+from src.mentions import mention_digest
+from src.records import document_passages, document_record
+from src.text import normalise_text, normalise_texts, update_geography
+from src.titles import TitleAutomaton, TitleTable
+
+
+class CandidateIndex:
+    """
+    Documents bucketed by geography_iso and sorted by publication_ts within each
+    bucket, so that the documents which could be mentioned by a document can be
+    found by bisection rather than by comparing it with the whole dataset.
+    """
+
+    def __init__(self, dataset, store=None):
+        self.size = 0
+        self.store = store
+        self.buckets = defaultdict(list)
+        for document in map(document_record, dataset):
+            self.buckets[document.geography_iso].append(document)
+            self.size += 1
+        self.timestamps = {}
+        self.positions = defaultdict(list)
+        self.id_timestamps = defaultdict(list)
+        for geography_iso, bucket in self.buckets.items():
+            bucket.sort(key=lambda document: document.publication_ts)
+            self.timestamps[geography_iso] = [
+                document.publication_ts for document in bucket
+            ]
+            for position, document in enumerate(bucket):
+                self.positions[geography_iso, document.document_id].append(position)
+                self.id_timestamps[document.document_id].append(document.publication_ts)
+        self.all_timestamps = None
+        self.titles = None
+        self.cross_postings = None
+        self.geography_index = None
+
+    def candidates(self, document) -> tuple[list, int]:
+        """
+        Return the bucket sharing the document's geography and the position of the
+        first document in it which was published at or after the document.
+        """
+        bucket = self.buckets.get(document.geography_iso, [])
+        if not bucket:
+            return bucket, 0
+        return bucket, bisect_left(self.timestamps[document.geography_iso], document.publication_ts)
+
+    def count_candidates(self, document, first_candidate: int) -> int:
+        """Count the candidates from first_candidate onwards, excluding the document itself."""
+        geography_iso = document.geography_iso
+        own_positions = self.positions.get((geography_iso, document.document_id), [])
+        return (
+            len(self.buckets.get(geography_iso, []))
+            - first_candidate
+            - sum(position >= first_candidate for position in own_positions)
+        )
+
+    def count_all_candidates(self, document) -> int:
+        """Count the documents in any geography published at or after the document, excluding itself."""
+        publication_ts = document.publication_ts
+        own_copies = sum(
+            timestamp >= publication_ts for timestamp in self.id_timestamps[document.document_id]
+        )
+        return self.size - bisect_left(self.sorted_timestamps(), publication_ts) - own_copies
+
+    def sorted_timestamps(self) -> list:
+        if self.all_timestamps is None:
+            self.all_timestamps = sorted(chain.from_iterable(self.timestamps.values()))
+        return self.all_timestamps
+
+    def compile(self, cross_geography: bool = False):
+        """Build the lazily built indexes up front, eg. before forking worker processes."""
+        if cross_geography:
+            self.sorted_timestamps()
+        self.title_table(cross_geography)
+
+    def title_table(self, cross_geography: bool = False) -> TitleTable:
+        """
+        Compile the distinct titles of every bucket into one TitleTable, whose
+        postings fan out to the documents which carry each title.
+
+        Titles are matched case-insensitively, so documents sharing a lowercased
+        normalised title share a posting list, and each distinct document name is
+        only normalised once. For cross-geography matching, cross_postings maps
+        some titles to (document, title, geography) for the documents whose title
+        is matched when they don't share document_i's geography. The title has to
+        appear in the passage with its original case, alongside the document's
+        geography name.
+        """
+        if self.titles is not None and (self.cross_postings is not None or not cross_geography):
+            return self.titles
+
+        titles = TitleTable()
+        cross_postings = defaultdict(list)
+        normalised = {}
+        resolved_geographies = {}
+
+        def normalise(text):
+            if text not in normalised:
+                normalised[text] = normalise_text(text)
+            return normalised[text]
+
+        for geography_iso, bucket in self.buckets.items():
+            for document in bucket:
+                title = normalise(document.document_name)
+                titles.add(title.lower(), document)
+                if not cross_geography:
+                    continue
+
+                geography = document.geography
+                if not geography or geography == "nan":
+                    # Try to grab missing geography name with ISO code
+                    if geography_iso not in resolved_geographies:
+                        resolved_geographies[geography_iso] = update_geography(geography_iso)
+                    geography = resolved_geographies[geography_iso]
+                if geography:
+                    # find_title_and_geography normalises the already normalised title again
+                    cross_title = normalise(title)
+                    geography = normalise(geography)
+                else:
+                    cross_title = title
+                cross_postings[titles.title_id(cross_title.lower())].append(
+                    (document, cross_title, geography)
+                )
+
+        titles.compile()
+        self.titles = titles
+        if not cross_geography:
+            return titles
+        self.cross_postings = dict(cross_postings)
+        self.geography_index = GeographyIndex(
+            geography
+            for postings in cross_postings.values()
+            for _, _, geography in postings
+            if geography is not None
+        )
+        return titles
+
+
+class GeographyIndex:
+    """Finds the passages of a document which mention each geography name."""
+
+    def __init__(self, geographies: Iterable[str]):
+        self.ids = {}
+        for geography in geographies:
+            self.ids.setdefault(geography, len(self.ids))
+        self.automaton = TitleAutomaton(self.ids)
+
+    def positions(self, passages: list[str]) -> dict[str, list[int]]:
+        """Map each geography name to the ascending positions of the raw passages which contain it."""
+        positions = defaultdict(list)
+        for position, passage in enumerate(passages):
+            for geography in self.automaton.search(passage):
+                positions[self.automaton.patterns[geography]].append(position)
+        return positions
+
+    @staticmethod
+    def in_window(positions: list[int], position: int, passage_count: int) -> bool:
+        """Check whether a geography appears in the window find_title_and_geography searches around a passage."""
+        start, end = max(0, position - 2), min(passage_count, position + 2)
+        nearest = bisect_left(positions, start)
+        return nearest < len(positions) and positions[nearest] < end
+
+
+def normalised_document_passages(document, store=None, stats: Optional[Counter] = None) -> list[str]:
+    """Return the normalised passages of a document, from the store if it has them."""
+    passages = document_passages(document)
+    if store is not None:
+        normalised_passages = store.passages(document.document_id, passages)
+        if normalised_passages is not None:
+            return normalised_passages
+    if stats is not None:
+        stats["passages_normalised"] += len(passages)
+    return normalise_texts(passages)
+
+
+def iter_mentions(
+    documents,
+    dataset,
+    store=None,
+    stats: Optional[Counter] = None,
+    cross_geography: bool = False,
+) -> Iterator[tuple[str, str, str, str]]:
+    """
+    Yield (id_i, id_j, name_j, found_block) for each document_j in the dataset
+    whose title appears in one of the passages of document_i.
+
+    Only documents with the same geography as document_i, published at or after
+    it, are candidates. These are looked up in a CandidateIndex, and the passages
+    of document_i are scanned once for all of the distinct titles in its
+    TitleTable. found_block is the first passage which contains the title. If a
+    PassageStore is given, the pre-normalised passages are read from it instead
+    of being normalised again.
+
+    If cross_geography is set, documents from other geographies are candidates
+    too. They are mentioned if their title appears in a passage with its
+    original case and their geography is named in that passage or the
+    surrounding passages (see check_document_geography).
+
+    If stats is given, the number of candidate pairs considered and pruned is
+    added to it.
+    """
+    index = CandidateIndex(dataset, store)
+    if cross_geography:
+        yield from iter_all_geography_mentions(documents, index, stats)
+    else:
+        yield from iter_same_geography_mentions(documents, index, stats)
+
+
+def iter_same_geography_mentions(
+    documents, index: CandidateIndex, stats: Optional[Counter] = None
+) -> Iterator[tuple[str, str, str, str]]:
+    store = index.store
+    titles = index.title_table()
+    automaton = titles.compile()
+    for document_i in map(document_record, documents):
+        _, first_candidate = index.candidates(document_i)
+        considered = index.count_candidates(document_i, first_candidate)
+        if stats is not None:
+            stats["candidates_considered"] += considered
+            stats["candidates_pruned"] += index.size - considered
+        if not considered:
+            continue
+
+        normalised_passages = normalised_document_passages(document_i, store, stats)
+
+        first_positions = {}
+        for position, passage in enumerate(normalised_passages):
+            for title_id in automaton.search(passage.lower()):
+                first_positions.setdefault(title_id, position)
+        if not first_positions:
+            continue
+
+        passages = document_passages(document_i)
+        for title_id, position in first_positions.items():
+            found_block = passages[position]
+            if not found_block:
+                continue
+            # only fan out to the documents with the title in document_i's
+            # geography which were published at or after it
+            start, end = titles.span(title_id, document_i.geography_iso, document_i.publication_ts)
+            for document_j in titles.targets[title_id][start:end]:
+                if document_i.document_id == document_j.document_id:
+                    continue
+                yield (
+                    document_i.document_id,
+                    document_j.document_id,
+                    document_j.document_name,
+                    found_block,
+                )
+
+
+def iter_all_geography_mentions(
+    documents, index: CandidateIndex, stats: Optional[Counter] = None
+) -> Iterator[tuple[str, str, str, str]]:
+    store = index.store
+    titles = index.title_table(cross_geography=True)
+    automaton = titles.compile()
+    cross_postings = index.cross_postings
+
+    for document_i in map(document_record, documents):
+        considered = index.count_all_candidates(document_i)
+        if stats is not None:
+            stats["candidates_considered"] += considered
+            stats["candidates_pruned"] += index.size - considered
+        if not considered:
+            continue
+
+        normalised_passages = normalised_document_passages(document_i, store, stats)
+
+        hit_positions = defaultdict(list)
+        for position, passage in enumerate(normalised_passages):
+            for title_id in automaton.search(passage.lower()):
+                hit_positions[title_id].append(position)
+        if not hit_positions:
+            continue
+
+        passages = document_passages(document_i)
+        geography_positions = None
+
+        for title_id, positions in hit_positions.items():
+            found_block = passages[positions[0]]
+            if found_block:
+                start, end = titles.span(
+                    title_id, document_i.geography_iso, document_i.publication_ts
+                )
+                for document_j in titles.targets[title_id][start:end]:
+                    if document_j.document_id != document_i.document_id:
+                        yield (
+                            document_i.document_id,
+                            document_j.document_id,
+                            document_j.document_name,
+                            found_block,
+                        )
+
+            for document_j, title, geography in cross_postings.get(title_id, ()):
+                if (
+                    document_j.geography_iso == document_i.geography_iso
+                    or document_j.publication_ts < document_i.publication_ts
+                    or document_j.document_id == document_i.document_id
+                ):
+                    continue
+                for passage_position in positions:
+                    if title not in normalised_passages[passage_position]:
+                        continue
+                    if geography is not None:
+                        if geography_positions is None:
+                            geography_positions = index.geography_index.positions(passages)
+                        if not GeographyIndex.in_window(
+                            geography_positions.get(geography, []), passage_position, len(passages)
+                        ):
+                            continue
+                    if passages[passage_position]:
+                        yield (
+                            document_i.document_id,
+                            document_j.document_id,
+                            document_j.document_name,
+                            passages[passage_position],
+                        )
+                    break
+
+
+def find_mentions(
+    documents,
+    dataset,
+    store=None,
+    stats: Optional[Counter] = None,
+    cross_geography: bool = False,
+) -> set[tuple[str, str, str, str]]:
+    return set(iter_mentions(documents, dataset, store, stats, cross_geography))
+
+
+
+# State shared with the worker processes of find_mentions_parallel. It's set
+# before the pool is forked, so workers inherit the dataset and the compiled
+# indexes rather than having them pickled and sent to each of them.
+_shared = {}
+
+
+def _find_shard_mentions(bounds: tuple[int, int]) -> tuple[int, set, Counter]:
+    start, end = bounds
+    shard = _shared["documents"][start:end]
+    stats = Counter()
+    if _shared["cross_geography"]:
+        mentions = set(iter_all_geography_mentions(shard, _shared["index"], stats))
+    else:
+        mentions = set(iter_same_geography_mentions(shard, _shared["index"], stats))
+    return end - start, mentions, stats
+
+
+def find_mentions_parallel(
+    documents,
+    dataset,
+    store=None,
+    stats: Optional[Counter] = None,
+    cross_geography: bool = False,
+    processes: Optional[int] = None,
+    chunk_size: int = 64,
+    on_progress: Optional[Callable[[int], None]] = None,
+    on_mentions: Optional[Callable[[list], None]] = None,
+    collect: bool = True,
+) -> Optional[set[tuple[str, str, str, str]]]:
+    """
+    Find the same mentions as find_mentions, sharding documents across a pool of
+    forked processes. As each shard finishes, on_progress is called with its
+    number of documents and on_mentions with the mentions it found which
+    haven't been seen in an earlier shard, sorted. Shards are handed on in the
+    order of the documents, whichever finishes first, so the mentions are
+    passed to on_mentions in the same order on every run.
+
+    Only a couple of shards per process are queued at a time, so if on_mentions
+    blocks (eg. while the graph writes catch up) the workers stop rather than
+    piling up their results. If collect is False the mentions are only passed
+    to on_mentions, and just a digest of each is kept to drop duplicates, so
+    None is returned.
+    """
+    documents = [document_record(document) for document in documents]
+    index = CandidateIndex(dataset, store)
+    index.compile(cross_geography)
+    _shared.update(documents=documents, index=index, cross_geography=cross_geography)
+
+    shards = (
+        (start, min(start + chunk_size, len(documents)))
+        for start in range(0, len(documents), chunk_size)
+    )
+    mentions = set()
+    seen = set()
+
+    def hand_on(count: int, shard_mentions: set, shard_stats: Counter):
+        if collect:
+            new_mentions = shard_mentions - mentions
+            mentions.update(new_mentions)
+        else:
+            new_mentions = set()
+            for mention in shard_mentions:
+                digest = mention_digest(mention)
+                if digest not in seen:
+                    seen.add(digest)
+                    new_mentions.add(mention)
+        if on_mentions is not None:
+            on_mentions(sorted(new_mentions))
+        if stats is not None:
+            stats.update(shard_stats)
+        if on_progress is not None:
+            on_progress(count)
+
+    try:
+        with get_context("fork").Pool(processes) as pool:
+            window = 2 * (processes or os.cpu_count() or 1)
+            pending = deque()
+            for shard in shards:
+                pending.append(pool.apply_async(_find_shard_mentions, (shard,)))
+                if len(pending) == window:
+                    # wait for the oldest shard before queueing another
+                    hand_on(*pending.popleft().get())
+            while pending:
+                hand_on(*pending.popleft().get())
+    finally:
+        _shared.clear()
+    return mentions if collect else None
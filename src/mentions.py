@@ -0,0 +1,121 @@
+import json
+import os
+from array import array
+from hashlib import blake2b
+from pathlib import Path
+from typing import Iterable, Iterator, Union
+
+from src.store import map_file
+
+
+def mention_record(mention: Union[tuple, dict]) -> dict:
+    if isinstance(mention, dict):
+        return mention
+    id_i, id_j, name_j, found_block = mention
+    return {
+        "document_id_i": id_i,
+        "document_id_j": id_j,
+        "document_name_j": name_j,
+        "found_block": found_block,
+    }
+
+
+def mention_digest(mention: Union[tuple, dict]) -> bytes:
+    """
+    A digest of a mention, the same whether it's a tuple or a record. Identical
+    mentions are serialised identically, so the digests are enough to spot
+    duplicates without holding every passage in memory.
+    """
+    return blake2b(json.dumps(mention_record(mention)).encode("utf-8"), digest_size=16).digest()
+
+
+def index_path(path: Path) -> Path:
+    return Path(f"{path}.idx")
+
+
+class MentionWriter:
+    """
+    Writes mentions to a JSONL file as they're found, one record per line.
+
+    The byte offset of each line is written to a sidecar index file (see
+    read_mention). Both files are written under a temporary name and only
+    replace the previous files when the writer is closed, so readers never see
+    a partly written file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.partial_path = Path(f"{self.path}.partial")
+        self.file = open(self.partial_path, "wb")
+        self.index_file = open(index_path(self.partial_path), "wb")
+        self.count = 0
+
+    def write(self, mention: Union[tuple, dict]):
+        array("Q", [self.file.tell()]).tofile(self.index_file)
+        self.file.write(json.dumps(mention_record(mention)).encode("utf-8") + b"\n")
+        self.count += 1
+
+    def write_all(self, mentions: Iterable[Union[tuple, dict]]):
+        for mention in mentions:
+            self.write(mention)
+
+    def close(self):
+        self.file.close()
+        self.index_file.close()
+        os.replace(self.partial_path, self.path)
+        os.replace(index_path(self.partial_path), index_path(self.path))
+
+    def __enter__(self) -> "MentionWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            self.index_file.close()
+
+
+def read_mentions(path: Path) -> Iterator[dict]:
+    """Yield the mentions in a JSONL file one at a time."""
+    with open(path, "rb") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def count_mentions(path: Path) -> int:
+    return index_path(path).stat().st_size // 8
+
+
+def read_mention(path: Path, position: int) -> dict:
+    """Read a single mention from a JSONL file, using its index to seek straight to it."""
+    offsets = map_file(index_path(path)).cast("Q")
+    with open(path, "rb") as f:
+        f.seek(offsets[position])
+        return json.loads(f.readline())
+
+
+def mentions_to_jsonl(json_path: Path, jsonl_path: Path) -> int:
+    """Convert a mentions.json file to JSONL, returning the number of mentions."""
+    with open(json_path) as f:
+        mentions = json.load(f).get("mentions", [])
+    with MentionWriter(jsonl_path) as writer:
+        writer.write_all(mentions)
+    return len(mentions)
+
+
+def jsonl_to_mentions(jsonl_path: Path, json_path: Path) -> int:
+    """
+    Convert a JSONL file to the mentions.json format, returning the number of
+    mentions. The mentions are streamed, and the output is laid out as
+    json.dump(..., indent=2) would lay it out.
+    """
+    count = 0
+    with open(json_path, "w") as f:
+        f.write('{\n  "mentions": [')
+        for mention in read_mentions(jsonl_path):
+            record = json.dumps(mention, indent=2).replace("\n", "\n    ")
+            f.write(("," if count else "") + "\n    " + record)
+            count += 1
+        f.write("\n  ]\n}" if count else "]\n}")
+    return count
@@ -0,0 +1,197 @@
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+METRICS_DIRECTORY = Path("data/metrics")
+
+
+class StageTimer:
+    """Timing for one stage of a run, accumulated over every time the stage is entered."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.items = None
+        self.unit = None
+
+    def report(self) -> dict:
+        report = {"seconds": self.seconds, "calls": self.calls}
+        if self.items is not None:
+            report.update(items=self.items, unit=self.unit)
+            report["items_per_second"] = self.items / self.seconds if self.seconds else None
+        return report
+
+
+class Metrics:
+    """
+    Stage timers, counters and latencies for a run of the pipeline, which can be
+    written out as a JSON report at the end of the run.
+
+    There's a single instance, metrics, which the pipeline's modules record into.
+    Worker processes forked by find_mentions_parallel get their own copy of it,
+    so anything counted in them has to be passed back to the parent (as the
+    candidate stats are) and added here.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, run: str = "pipeline"):
+        self.run = run
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = Counter()
+        self.latencies = {}
+        self.profiler = None
+
+    @contextmanager
+    def stage(self, name: str, counter: Optional[str] = None) -> Iterator[StageTimer]:
+        """
+        Time a stage. If a counter is given, the amount it increases by during
+        the stage is recorded as the number of items the stage processed, and
+        its throughput is reported.
+        """
+        timer = self.stages.setdefault(name, StageTimer())
+        count_before = self.counters[counter] if counter else 0
+        start = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            timer.seconds += time.perf_counter() - start
+            timer.calls += 1
+            if counter:
+                timer.items = (timer.items or 0) + self.counters[counter] - count_before
+                timer.unit = counter
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def observe(self, name: str, seconds: float):
+        self.latencies.setdefault(name, []).append(seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Record how long a single operation took, eg. a round trip to the database."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def report(self, **context) -> dict:
+        latencies = {}
+        for name, samples in self.latencies.items():
+            ordered = sorted(samples)
+            latencies[name] = {
+                "count": len(ordered),
+                "total_seconds": sum(ordered),
+                "mean_seconds": sum(ordered) / len(ordered),
+                "p50_seconds": ordered[len(ordered) // 2],
+                "p95_seconds": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max_seconds": ordered[-1],
+            }
+        report = {
+            "run": self.run,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "seconds": time.perf_counter() - self.start,
+            "python": sys.version.split()[0],
+            "context": context,
+            "stages": {name: timer.report() for name, timer in self.stages.items()},
+            "counters": dict(self.counters),
+            "latencies": latencies,
+        }
+        if self.profiler is not None:
+            report["profile"] = self.profiler.report()
+        return report
+
+    def write_report(self, path: Optional[Path] = None, **context) -> Path:
+        """Write the report, by default to data/metrics/<run>-<start time>.json, and return its path."""
+        if path is None:
+            path = METRICS_DIRECTORY / f"{self.run}-{self.started_at:%Y%m%dT%H%M%S}.json"
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.profiler is not None:
+            self.profiler.stop()
+        with open(path, "w") as f:
+            json.dump(self.report(**context), f, indent=2, default=str)
+        if self.profiler is not None:
+            self.profiler.write_collapsed(path.with_suffix(".stacks"))
+        return path
+
+    def start_profiler(self, interval: float = 0.01) -> "SamplingProfiler":
+        self.profiler = SamplingProfiler(interval)
+        self.profiler.start()
+        return self.profiler
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every other thread in the process at a fixed interval,
+    from a background thread, so it costs far less than a tracing profiler and
+    can be left on for a whole run. Stacks are counted in the collapsed format
+    used by flame graph tools (outermost frame first, separated by ";"). Only
+    the current process is sampled, not the workers of find_mentions_parallel.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join()
+
+    def _sample(self):
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def report(self, top: int = 25) -> dict:
+        """The functions which were most often running when sampled, with how often they were on the stack at all."""
+        self_samples = Counter()
+        total_samples = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            self_samples[frames[-1]] += count
+            for frame in set(frames):
+                total_samples[frame] += count
+        return {
+            "interval_seconds": self.interval,
+            "samples": self.samples,
+            "top_functions": [
+                {"function": frame, "self_samples": count, "total_samples": total_samples[frame]}
+                for frame, count in self_samples.most_common(top)
+            ],
+        }
+
+    def write_collapsed(self, path: Path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+metrics = Metrics()
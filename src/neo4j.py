@@ -1,9 +1,13 @@
 from rich.console import Console
 import time
 import neomodel
+from src.metrics import metrics
+from src.records import document_record
 
 def clear_neo4j():
-    neomodel.db.cypher_query('MATCH (n) DETACH DELETE n')
+    with metrics.timer("neo4j_clear"):
+        neomodel.db.cypher_query('MATCH (n) DETACH DELETE n')
+    metrics.count("neo4j_round_trips")
 
 
 def ping():
@@ -18,3 +22,109 @@ def wait_for_neo4j():
     with Console().status("Waiting for neo4j to start..."):
         while not ping():
             time.sleep(1)
+
+
+# Bulk equivalents of DocumentNode/FamilyNode.get_or_create and connect, which
+# MERGE on the unique properties and set the rest only when a node is created
+DOCUMENTS_QUERY = """
+UNWIND $rows AS row
+MERGE (document:DocumentNode {document_id: row.document_id})
+ON CREATE SET document.document_name = row.document_name
+WITH document, row
+WHERE row.family_id IS NOT NULL
+MERGE (family:FamilyNode {family_id: row.family_id})
+ON CREATE SET family.family_name = row.family_name
+MERGE (document)-[:BELONGS_TO]->(family)
+"""
+
+MENTIONS_QUERY = """
+UNWIND $rows AS row
+MATCH (document_i:DocumentNode {document_id: row.document_id_i})
+MATCH (document_j:DocumentNode {document_id: row.document_id_j})
+MERGE (document_i)-[:MENTIONS]->(document_j)
+"""
+
+
+# The uniqueness constraints which unique_index declares in src.models. neomodel
+# only creates them in install_labels, and without them every MERGE and MATCH on
+# an id above scans all of the nodes with that label. They have the names
+# install_labels would give them, so it sees them as already installed.
+CONSTRAINT_QUERIES = [
+    "CREATE CONSTRAINT constraint_unique_DocumentNode_document_id IF NOT EXISTS "
+    "FOR (node:DocumentNode) REQUIRE node.document_id IS UNIQUE",
+    "CREATE CONSTRAINT constraint_unique_FamilyNode_family_id IF NOT EXISTS "
+    "FOR (node:FamilyNode) REQUIRE node.family_id IS UNIQUE",
+]
+
+
+def create_constraints():
+    for query in CONSTRAINT_QUERIES:
+        neomodel.db.cypher_query(query)
+        metrics.count("neo4j_round_trips")
+
+
+def batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_batches(query, rows, batch_size=1000):
+    # schema changes can't share a transaction with writes, so the constraints
+    # are created on their own before the first batch
+    create_constraints()
+    # each batch is sent in a single round trip and committed in its own transaction
+    for batch in batches(rows, batch_size):
+        with metrics.timer("neo4j_write_batch"), neomodel.db.transaction:
+            neomodel.db.cypher_query(query, {"rows": batch})
+        metrics.count("neo4j_round_trips")
+        metrics.count("neo4j_rows_written", len(batch))
+
+
+def document_rows(documents):
+    for document in map(document_record, documents):
+        yield {
+            "document_id": document.document_id,
+            "document_name": document.document_name,
+            "family_id": document.family_id,
+            "family_name": document.family_name,
+        }
+
+
+def mention_rows(mentions):
+    for id_i, id_j, *_ in mentions:
+        yield {"document_id_i": id_i, "document_id_j": id_j}
+
+
+def write_documents(documents, batch_size=1000):
+    write_batches(DOCUMENTS_QUERY, document_rows(documents), batch_size)
+
+
+def write_mentions(mentions, batch_size=1000):
+    write_batches(MENTIONS_QUERY, mention_rows(mentions), batch_size)
+
+
+DELETE_DOCUMENTS_QUERY = """
+UNWIND $rows AS row
+MATCH (document:DocumentNode {document_id: row.document_id})
+DETACH DELETE document
+"""
+
+DELETE_EMPTY_FAMILIES_QUERY = """
+MATCH (family:FamilyNode)
+WHERE NOT (family)<-[:BELONGS_TO]-()
+DELETE family
+"""
+
+
+def delete_documents(document_ids, batch_size=1000):
+    """Remove documents along with their BELONGS_TO and MENTIONS edges, and any families left empty."""
+    rows = ({"document_id": document_id} for document_id in document_ids)
+    write_batches(DELETE_DOCUMENTS_QUERY, rows, batch_size)
+    neomodel.db.cypher_query(DELETE_EMPTY_FAMILIES_QUERY)
+    metrics.count("neo4j_round_trips")
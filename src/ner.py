@@ -0,0 +1,183 @@
+import json
+import sqlite3
+import time
+from hashlib import blake2b
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import spacy
+from spacy.language import Language
+from spacy.tokens import Doc
+
+from src.metrics import metrics
+from src.records import document_passages
+
+POLICY_SPANS_KEY = "policy"
+COUNTRY_LABELS = ["GPE", "LOC"]
+
+
+@Language.component("keep_policy_entities")
+def keep_policy_entities(doc: Doc) -> Doc:
+    # Move the policy model's entities out of the way, so the country model
+    # makes its own predictions rather than working around them
+    doc.spans[POLICY_SPANS_KEY] = list(doc.ents)
+    doc.set_ents([], default="missing")
+    return doc
+
+
+def load_inference_pipeline(model_path: str, countries_model: str = "en_core_web_sm") -> Language:
+    """
+    Load a pipeline which runs the trained policy NER and the country NER in one
+    pass. Only the NER components are enabled, as nothing else is used. Both
+    NER components have their own tok2vec layers, so their predictions are the
+    same as running each model separately.
+    """
+    nlp = spacy.load(model_path, enable=["ner"])
+    nlp.add_pipe("keep_policy_entities", after="ner")
+    nlp.add_pipe(
+        "ner", name="country_ner", source=spacy.load(countries_model, enable=["ner"]), last=True
+    )
+    return nlp
+
+
+def policy_entities(doc: Doc) -> set[tuple[int, int]]:
+    return {(ent.start_char, ent.end_char) for ent in doc.spans[POLICY_SPANS_KEY]}
+
+
+def country_entities(doc: Doc) -> set[str]:
+    return {ent.text for ent in doc.ents if ent.label_ in COUNTRY_LABELS}
+
+
+def iter_passages(data) -> Iterator[str]:
+    for document in data:
+        yield from document_passages(document)
+
+
+def pipe_passages(
+    nlp: Language, texts: Iterable[str], batch_size: int = 256, n_process: int = 1
+) -> Iterator[Doc]:
+    """Stream texts through the pipeline in batches, optionally across several processes."""
+    return nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+
+
+def model_fingerprint(nlp: Language) -> str:
+    """Hash a pipeline's config and weights, so predictions from a different model are never reused."""
+    return blake2b(nlp.to_bytes(), digest_size=16).hexdigest()
+
+
+class PredictionCache:
+    """
+    Persistent cache of the policy spans and countries predicted for each
+    passage, stored in SQLite and keyed by a hash of the model fingerprint and
+    the passage text.
+
+    The database uses write-ahead logging, so any number of processes can read
+    from it while one of them writes. Once it holds more than max_entries
+    predictions, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: Path, fingerprint: str, max_entries: int = 1_000_000):
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions "
+            "(key BLOB PRIMARY KEY, policy TEXT, countries TEXT, last_used INTEGER)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)"
+        )
+        self.connection.commit()
+
+    def key(self, text: str) -> bytes:
+        digest = blake2b(digest_size=16)
+        digest.update(self.fingerprint.encode("utf-8") + b"\x00")
+        digest.update(text.encode("utf-8"))
+        return digest.digest()
+
+    def get_many(self, texts: Iterable[str]) -> dict[str, tuple[set, set]]:
+        keys = {self.key(text): text for text in texts}
+        predictions = {}
+        key_list = list(keys)
+        # SQLite limits the number of parameters in a single statement
+        for start in range(0, len(key_list), 500):
+            batch = key_list[start : start + 500]
+            rows = self.connection.execute(
+                "SELECT key, policy, countries FROM predictions "
+                f"WHERE key IN ({', '.join('?' * len(batch))})",
+                batch,
+            )
+            for key, policy, countries in rows:
+                predictions[keys[key]] = (
+                    {tuple(span) for span in json.loads(policy)},
+                    set(json.loads(countries)),
+                )
+        if predictions:
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE predictions SET last_used = ? WHERE key = ?",
+                    [(time.time_ns(), self.key(text)) for text in predictions],
+                )
+        return predictions
+
+    def put_many(self, predictions: dict[str, tuple[set, set]]):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        self.key(text),
+                        json.dumps(sorted(policy)),
+                        json.dumps(sorted(countries)),
+                        time.time_ns(),
+                    )
+                    for text, (policy, countries) in predictions.items()
+                ],
+            )
+        self.evict()
+
+    def evict(self):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM predictions").fetchone()
+        if count > self.max_entries:
+            with self.connection:
+                self.connection.execute(
+                    "DELETE FROM predictions WHERE key IN "
+                    "(SELECT key FROM predictions ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def close(self):
+        self.connection.close()
+
+
+def predict_entities(
+    nlp: Language,
+    texts: Iterable[str],
+    cache: Optional[PredictionCache] = None,
+    batch_size: int = 256,
+    n_process: int = 1,
+    chunk_size: int = 10_000,
+) -> Iterator[tuple[str, set[tuple[int, int]], set[str]]]:
+    """
+    Yield (text, policy spans, countries) for each text, in order. Predictions
+    are read from the cache where possible, and only the remaining texts are
+    run through the pipeline.
+    """
+    texts = iter(texts)
+    while chunk := list(islice(texts, chunk_size)):
+        predictions = cache.get_many(chunk) if cache is not None else {}
+        missing = [text for text in dict.fromkeys(chunk) if text not in predictions]
+        new_predictions = {
+            text: (policy_entities(doc), country_entities(doc))
+            for text, doc in zip(missing, pipe_passages(nlp, missing, batch_size, n_process))
+        }
+        if cache is not None and new_predictions:
+            cache.put_many(new_predictions)
+        predictions.update(new_predictions)
+        metrics.count("ner_passages", len(chunk))
+        metrics.count("ner_passages_predicted", len(missing))
+        for text in chunk:
+            yield (text, *predictions[text])
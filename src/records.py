@@ -0,0 +1,121 @@
+from datetime import datetime
+from typing import NamedTuple, Optional, Sequence
+
+
+class CachedTextBlock(NamedTuple):
+    text: list[str]
+
+
+class CachedDocumentMetadata(NamedTuple):
+    family_id: Optional[str]
+    family_name: Optional[str]
+    geography: Optional[str]
+    geography_iso: Optional[str]
+    publication_ts: Optional[datetime]
+
+
+class DocumentRecord:
+    """
+    A compact, read-only view of a document, with its metadata as flat
+    attributes and its passages as one flat, immutable sequence.
+
+    Only the fields which the pipeline reads are kept, so records take far less
+    memory than the CPRDocument objects they can be made from, and looking up
+    eg. record.geography_iso is a single slot access rather than going through
+    document_metadata. The passages sequence is shared rather than rebuilt from
+    the text blocks each time it's needed. document_metadata and text_blocks
+    are still available, built on access, for code which expects a CPRDocument.
+    """
+
+    __slots__ = (
+        "document_id",
+        "document_name",
+        "translated",
+        "has_metadata",
+        "family_id",
+        "family_name",
+        "geography",
+        "geography_iso",
+        "publication_ts",
+        "passages",
+        "block_lengths",
+    )
+
+    def __init__(
+        self,
+        document_id: str,
+        document_name: str,
+        translated: bool,
+        metadata: Optional[CachedDocumentMetadata],
+        passages: Sequence[str],
+        block_lengths: Optional[Sequence[int]],
+    ):
+        self.document_id = document_id
+        self.document_name = document_name
+        self.translated = translated
+        self.has_metadata = metadata is not None
+        if metadata is None:
+            metadata = CachedDocumentMetadata(None, None, None, None, None)
+        self.family_id = metadata.family_id
+        self.family_name = metadata.family_name
+        self.geography = metadata.geography
+        self.geography_iso = metadata.geography_iso
+        self.publication_ts = metadata.publication_ts
+        self.passages = passages
+        self.block_lengths = block_lengths
+
+    @classmethod
+    def from_document(cls, document) -> "DocumentRecord":
+        passages = []
+        block_lengths = []
+        for block in document.text_blocks:
+            passages.extend(block.text)
+            block_lengths.append(len(block.text))
+        metadata = document.document_metadata
+        if metadata is not None:
+            metadata = CachedDocumentMetadata(
+                metadata.family_id,
+                metadata.family_name,
+                metadata.geography,
+                metadata.geography_iso,
+                metadata.publication_ts,
+            )
+        return cls(
+            document.document_id,
+            document.document_name,
+            document.translated,
+            metadata,
+            tuple(passages),
+            tuple(block_lengths),
+        )
+
+    @property
+    def document_metadata(self) -> Optional[CachedDocumentMetadata]:
+        if not self.has_metadata:
+            return None
+        return CachedDocumentMetadata(
+            self.family_id, self.family_name, self.geography, self.geography_iso, self.publication_ts
+        )
+
+    @property
+    def text_blocks(self) -> list[CachedTextBlock]:
+        blocks = []
+        start = 0
+        for length in self.block_lengths:
+            blocks.append(CachedTextBlock(list(self.passages[start : start + length])))
+            start += length
+        return blocks
+
+
+def document_record(document) -> DocumentRecord:
+    """Return a DocumentRecord for any document, without copying it if it already is one."""
+    if isinstance(document, DocumentRecord):
+        return document
+    return DocumentRecord.from_document(document)
+
+
+def document_passages(document) -> Sequence[str]:
+    """Every passage of a document in order, across all of its text blocks."""
+    if isinstance(document, DocumentRecord):
+        return document.passages
+    return [passage for block in document.text_blocks for passage in block.text]
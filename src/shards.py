@@ -0,0 +1,80 @@
+"""
+Splitting the mention-finding between independent runs, eg. on different
+machines, and merging what they find.
+
+Each document is assigned to one of N shards by a hash of its document_id, so
+every run agrees on the split without talking to the others. A shard run finds
+the mentions in its own documents of every document in the dataset, and writes
+them to its own file in data/shards, alongside a small JSON file recording the
+dataset it was run on. merge_shard_mentions combines the files of all N shards.
+"""
+import json
+from hashlib import blake2b
+from pathlib import Path
+
+from src.mentions import MentionWriter, mention_digest, read_mentions
+from src.metrics import metrics
+
+SHARDS_PATH = Path("data/shards")
+
+
+def shard_of(document_id: str, shards: int) -> int:
+    """
+    The shard a document belongs to. This uses blake2b rather than hash, whose
+    value for a string changes between Python processes.
+    """
+    digest = blake2b(document_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def shard_documents(documents, shard: int, shards: int) -> list:
+    return [document for document in documents if shard_of(document.document_id, shards) == shard]
+
+
+def shard_path(shard: int, shards: int) -> Path:
+    return SHARDS_PATH / f"mentions-{shard}-of-{shards}.jsonl"
+
+
+def shard_info_path(shard: int, shards: int) -> Path:
+    return SHARDS_PATH / f"mentions-{shard}-of-{shards}.json"
+
+
+def save_shard_info(shard: int, shards: int, fingerprint: str, mentions: int):
+    """Record that a shard is complete, and which dataset it was run on."""
+    with open(shard_info_path(shard, shards), "w") as f:
+        json.dump({"shard": shard, "shards": shards, "fingerprint": fingerprint, "mentions": mentions}, f)
+
+
+def check_shards(shards: int, fingerprint: str):
+    """Check that every one of N shards has finished, and that they were all run on the same dataset."""
+    missing = [shard for shard in range(shards) if not shard_info_path(shard, shards).exists()]
+    if missing:
+        raise FileNotFoundError(
+            f"Shards {', '.join(map(str, missing))} of {shards} haven't finished (no {shard_info_path(missing[0], shards)})"
+        )
+    for shard in range(shards):
+        with open(shard_info_path(shard, shards)) as f:
+            info = json.load(f)
+        if info["fingerprint"] != fingerprint:
+            raise ValueError(f"Shard {shard} of {shards} was run on a different version of the dataset")
+
+
+def merge_shard_mentions(shards: int, path: Path, fingerprint: str) -> int:
+    """
+    Write the mentions found by all N shards to one JSONL file, dropping any
+    duplicates, and return the number of mentions written. Shards are merged in
+    order, and the mentions of each shard keep their order.
+    """
+    check_shards(shards, fingerprint)
+    seen = set()
+    with MentionWriter(path) as writer:
+        for shard in range(shards):
+            for mention in read_mentions(shard_path(shard, shards)):
+                key = mention_digest(mention)
+                if key in seen:
+                    metrics.count("duplicate_mentions")
+                    continue
+                seen.add(key)
+                writer.write(mention)
+                metrics.count("mentions_merged")
+    return writer.count
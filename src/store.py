@@ -0,0 +1,150 @@
+import json
+import mmap
+from array import array
+from hashlib import blake2b
+from pathlib import Path
+from typing import Optional, Sequence
+
+from src.metrics import metrics
+from src.records import document_passages
+from src.text import normalise_texts
+
+STORE_VERSION = 3
+
+
+def dataset_fingerprint(documents) -> str:
+    """Hash the ids, titles and passages of a dataset so that a stale store can be detected."""
+    digest = blake2b(digest_size=16)
+    for document in documents:
+        digest.update(document.document_id.encode("utf-8") + b"\x00")
+        digest.update(document.document_name.encode("utf-8") + b"\x00")
+        for passage in document_passages(document):
+            digest.update(passage.encode("utf-8") + b"\x01")
+        digest.update(b"\x02")
+    return digest.hexdigest()
+
+
+def map_file(path: Path) -> memoryview:
+    """Memory-map a file read-only."""
+    # mmap refuses to map empty files, so fall back to an empty buffer
+    if path.stat().st_size == 0:
+        return memoryview(b"")
+    with open(path, "rb") as f:
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def passage_digest(passage: str) -> bytes:
+    return blake2b(passage.encode("utf-8"), digest_size=8).digest()
+
+
+class PassageStore:
+    """
+    Normalised passages for a dataset, stored on disk.
+
+    Passages are concatenated into a single memory-mapped file and addressed by
+    an array of offsets. index.json maps each document_id to the range of
+    passages in that array of each document with that id, in dataset order, as
+    a few ids are shared by more than one document. An
+    8-byte digest of each raw passage is kept alongside, so a raw passage (eg. a
+    found_block) can be mapped back to its normalised form, and the documents
+    which share an id can be told apart by their passages.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / "index.json") as f:
+            index = json.load(f)
+        if index["version"] != STORE_VERSION:
+            raise ValueError(f"Unsupported passage store version {index['version']}")
+        self.fingerprint = index["fingerprint"]
+        self.documents = index["documents"]
+        self.passages_map = map_file(self.path / "passages.bin")
+        self.offsets = map_file(self.path / "offsets.bin").cast("Q")
+        self.digests = map_file(self.path / "digests.bin")
+
+    @classmethod
+    def build(cls, path: Path, documents, fingerprint: Optional[str] = None) -> "PassageStore":
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        if fingerprint is None:
+            fingerprint = dataset_fingerprint(documents)
+
+        offsets = array("Q", [0])
+        digests = bytearray()
+        index = {}
+        with open(path / "passages.bin", "wb") as f:
+            for document in documents:
+                start = len(offsets) - 1
+                passages = list(document_passages(document))
+                for passage, normalised_passage in zip(passages, normalise_texts(passages)):
+                    offsets.append(offsets[-1] + f.write(normalised_passage.encode("utf-8")))
+                    digests += passage_digest(passage)
+                metrics.count("passages_normalised", len(passages))
+                index.setdefault(document.document_id, []).append([start, len(offsets) - 1])
+
+        with open(path / "offsets.bin", "wb") as f:
+            offsets.tofile(f)
+        with open(path / "digests.bin", "wb") as f:
+            f.write(digests)
+        # the index is written last, so an interrupted build never looks complete
+        with open(path / "index.json", "w") as f:
+            json.dump(
+                {"version": STORE_VERSION, "fingerprint": fingerprint, "documents": index}, f
+            )
+        return cls(path)
+
+    def __contains__(self, document_id: str) -> bool:
+        return document_id in self.documents
+
+    def passage(self, position: int) -> str:
+        return str(self.passages_map[self.offsets[position] : self.offsets[position + 1]], "utf-8")
+
+    def passages(self, document_id: str, raw_passages: Optional[Sequence[str]] = None) -> Optional[list[str]]:
+        """
+        Return the normalised passages of a document, or None if it isn't in the
+        store. If raw_passages are given, they pick out the document with those
+        passages from any others with the same id.
+        """
+        entries = self.documents.get(document_id, [])
+        if raw_passages is not None:
+            entries = [entry for entry in entries if entry[1] - entry[0] == len(raw_passages)]
+            if len(entries) > 1:
+                digests = b"".join(map(passage_digest, raw_passages))
+                entries = [
+                    entry for entry in entries if self.digests[entry[0] * 8 : entry[1] * 8] == digests
+                ]
+        if not entries:
+            return None
+        start, end = entries[0]
+        return [self.passage(position) for position in range(start, end)]
+
+    def lookup(self, document_id: str, passage: str) -> Optional[str]:
+        """Return the normalised form of one of a document's raw passages, if it is in the store."""
+        digest = passage_digest(passage)
+        for start, end in self.documents.get(document_id, []):
+            for position in range(start, end):
+                if self.digests[position * 8 : position * 8 + 8] == digest:
+                    return self.passage(position)
+        return None
+
+
+def open_passage_store(path: Path, fingerprint: str) -> Optional[PassageStore]:
+    """Open the store at path if it exists and was built from the dataset with this fingerprint."""
+    if (Path(path) / "index.json").exists():
+        try:
+            store = PassageStore(path)
+        except ValueError:
+            # built by an older version, so it has to be rebuilt
+            return None
+        if store.fingerprint == fingerprint:
+            return store
+    return None
+
+
+def load_passage_store(path: Path, documents) -> PassageStore:
+    """Open the store at path, rebuilding it if it is missing or was built from a different dataset."""
+    fingerprint = dataset_fingerprint(documents)
+    store = open_passage_store(path, fingerprint)
+    if store is not None:
+        return store
+    return PassageStore.build(path, documents, fingerprint)
@@ -1,22 +1,43 @@
-import re
-import pycountry
-import pandas as pd
-from typing import Optional
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from src.records import document_record
+
+# Codes used in our data which stand in for a different ISO 3166 alpha-3 code
+GEOGRAPHY_CODE_OVERRIDES = {"EUR": "EUU"}
+
+# normalise_text collapses whitespace, strips the result and then removes
+# non-ascii characters and punctuation. After that, the only characters left are
+# ascii letters, digits, underscores and spaces, so parentheses are already gone
+# by the time the original parentheses pass ran, and it never matched anything.
+# str.split() splits on the same whitespace as \s, and everything else which
+# is removed is deleted by encoding to ascii and translating the bytes.
+REMOVED_CHARACTERS = bytes(
+    code for code in range(128) if not (chr(code).isalnum() or chr(code) in "_ ")
+)
+# normalise_texts joins strings with newlines once their whitespace has been
+# collapsed, so it keeps newlines in order to split the strings apart again
+BATCH_REMOVED_CHARACTERS = REMOVED_CHARACTERS.replace(b"\n", b"")
 
-csv_url = "https://github.com/lukes/ISO-3166-Countries-with-Regional-Codes/raw/master/all/all.csv"
-iso_df = pd.read_csv(csv_url)
-iso_data = dict(zip(iso_df['alpha-3'], iso_df['name']))
 
 def normalise_text(input_string: str) -> str:
-    # remove newlines and multiple spaces
-    clean_string = re.sub(r"\s+", " ", input_string).strip()
-    # remove all non-ascii characters
-    clean_string = re.sub(r"[^\x00-\x7F]+", "", clean_string)
-    # remove punctuation
-    clean_string = re.sub(r"[^\w\s]", "", clean_string)
-    # remove parentheses
-    clean_string = re.sub(r'\([^)]*\)', '', clean_string)
-    return clean_string
+    # remove newlines and multiple spaces, then non-ascii characters and punctuation
+    clean_string = " ".join(input_string.split())
+    return clean_string.encode("ascii", "ignore").translate(None, REMOVED_CHARACTERS).decode("ascii")
+
+
+def normalise_texts(input_strings: Iterable[str]) -> list[str]:
+    """
+    Normalise a batch of strings, eg. a list or a pandas/numpy array of
+    passages, giving the same results as calling normalise_text on each one.
+    """
+    collapsed_strings = [" ".join(input_string.split()) for input_string in input_strings]
+    joined = "\n".join(collapsed_strings)
+    if not joined:
+        # splitting "" would give one string, even for an empty batch
+        return [""] * len(collapsed_strings)
+    clean_strings = joined.encode("ascii", "ignore").translate(None, BATCH_REMOVED_CHARACTERS)
+    return clean_strings.decode("ascii").split("\n")
 
 
 def find_title_and_geography(text_blocks, title, geography) -> Optional[str]:
@@ -32,41 +53,56 @@ def find_title_and_geography(text_blocks, title, geography) -> Optional[str]:
                     return text
     return None
 
+@lru_cache(maxsize=None)
+def geography_names() -> dict[str, Optional[str]]:
+    """
+    Map ISO 3166 alpha-3 codes to country names, using the ISO 3166 data which
+    ships with pycountry, so no network access is needed. The table is built on
+    first use and the overridden codes resolve to the name of their replacement.
+    """
+    import pycountry
+
+    names = {country.alpha_3: country.name for country in pycountry.countries}
+    for code, replacement in GEOGRAPHY_CODE_OVERRIDES.items():
+        names[code] = names.get(replacement)
+    return names
+
+
 def update_geography(geography_iso):
-    if geography_iso == "EUR":
-        geography_iso = "EUU"
-    try:
-        new_geography = pycountry.countries.get(alpha_3=geography_iso)
-        if new_geography:
-            new_geography = new_geography.name
-    except LookupError:
-        new_geography = iso_data.get(geography_iso)
-    return new_geography
-
-def check_document_geography(document_i, document_j):
+    # codes are matched case-insensitively, as pycountry does
+    if not isinstance(geography_iso, str):
+        return None
+    return geography_names().get(geography_iso.upper())
+
+def check_document_geography(document_i, document_j, cross_geography=False):
+    document_i = document_record(document_i)
+    document_j = document_record(document_j)
     title_j = normalise_text(document_j.document_name)
-    text_blocks = [passage for block in document_i.text_blocks for passage in block.text]
+    text_blocks = document_i.passages
 
-    # Rename empty values to None
-    if document_j.document_metadata.geography == "nan":
-        document_j.document_metadata.geography = None
+    # Treat empty values as None
+    geography_j = document_j.geography
+    if geography_j == "nan":
+        geography_j = None
 
     # If the mention document and the document have the same geography, high likelihood of real mention
-    if document_i.document_metadata.geography_iso == document_j.document_metadata.geography_iso:
+    if document_i.geography_iso == document_j.geography_iso:
         for passage in text_blocks:
             if title_j.lower() in normalise_text(passage).lower():
                 return passage
     else:
-        return None
+        # Searching for the geography per pair is too slow to run over the whole
+        # corpus, so src.matching uses a per-document geography index instead
+        if not cross_geography:
+            return None
 
         # Check if the geography of the document is also mentioned in the text
-        if not document_j.document_metadata.geography:
+        if not geography_j:
             # Try to grab missing geography name with ISO code
-            new_geography = update_geography(document_j.document_metadata.geography_iso)
-            document_j.document_metadata.geography = new_geography
+            geography_j = update_geography(document_j.geography_iso)
 
-        if document_j.document_metadata.geography:
-            return find_title_and_geography(text_blocks, title_j, document_j.document_metadata.geography)
+        if geography_j:
+            return find_title_and_geography(text_blocks, title_j, geography_j)
         else:
             for passage in text_blocks:
                 if title_j in normalise_text(passage):
@@ -0,0 +1,156 @@
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+from operator import attrgetter
+from typing import Iterable, NamedTuple, Optional
+
+
+class TitleAutomaton:
+    """Aho-Corasick automaton which finds every pattern contained in a text in one pass."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = list(patterns)
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        self.empty = [index for index, pattern in enumerate(self.patterns) if not pattern]
+
+        for index, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[state][char] = next_state
+                state = next_state
+            self.out[state].append(index)
+
+        # breadth-first pass to link each state to its longest proper suffix state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.out[next_state] = self.out[next_state] + self.out[self.fail[next_state]]
+
+    def search(self, text: str) -> set[int]:
+        """Return the indices of every pattern which appears in the text."""
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set(self.empty)
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class TitlePosting(NamedTuple):
+    document_id: str
+    family_id: Optional[str]
+    geography_iso: Optional[str]
+    publication_ts: Optional[datetime]
+
+
+_publication_ts = attrgetter("publication_ts")
+
+
+class TitleTable:
+    """
+    The distinct titles of a set of documents, each with a posting list of the
+    documents which carry it.
+
+    Many documents share a title: translations, the documents of a family, and
+    the CPR and GST copies of a document. Each title is stored and searched for
+    once, and a hit on it is only fanned out to its documents after it's found.
+    Each document has a TitlePosting with the fields needed to decide whether
+    it's a candidate, alongside a target (eg. the document itself) to fan out
+    to. Once compiled, a title's postings are grouped by geography_iso, so
+    span gives the candidates in one geography, sorted by publication_ts.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.titles = []
+        self.postings = []
+        self.targets = []
+        self.spans = {}
+        self.automaton = None
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def title_id(self, title: str) -> int:
+        """Return the id of a title, adding it to the table if it's new."""
+        title_id = self.ids.get(title)
+        if title_id is None:
+            title_id = self.ids[title] = len(self.titles)
+            self.titles.append(title)
+            self.postings.append([])
+            self.targets.append([])
+        return title_id
+
+    def add(self, title: str, document, target=None) -> int:
+        """Add a document record to the posting list of a title, returning the title's id."""
+        title_id = self.title_id(title)
+        self.postings[title_id].append(
+            TitlePosting(
+                document.document_id,
+                document.family_id,
+                document.geography_iso,
+                document.publication_ts,
+            )
+        )
+        self.targets[title_id].append(document if target is None else target)
+        return title_id
+
+    def compile(self) -> TitleAutomaton:
+        """Group each title's postings by geography and build the automaton over every title."""
+        if self.automaton is not None:
+            return self.automaton
+        for title_id, postings in enumerate(self.postings):
+            if not postings:
+                continue
+            # stable, so documents keep the order they were added in within a geography
+            order = sorted(
+                range(len(postings)),
+                key=lambda k: (
+                    postings[k].geography_iso is None,
+                    postings[k].geography_iso or "",
+                    postings[k].publication_ts,
+                ),
+            )
+            self.postings[title_id] = postings = [postings[k] for k in order]
+            self.targets[title_id] = [self.targets[title_id][k] for k in order]
+            start = 0
+            for end in range(1, len(postings) + 1):
+                if end == len(postings) or postings[end].geography_iso != postings[start].geography_iso:
+                    self.spans[title_id, postings[start].geography_iso] = (start, end)
+                    start = end
+        self.automaton = TitleAutomaton(self.titles)
+        return self.automaton
+
+    def search(self, text: str) -> set[int]:
+        """Return the ids of every title which appears in the text."""
+        return self.compile().search(text)
+
+    def span(self, title_id: int, geography_iso, published_from=None) -> tuple[int, int]:
+        """
+        Return the range of a title's postings in a geography, starting from the
+        first one published at or after published_from if it's given.
+        """
+        start, end = self.spans.get((title_id, geography_iso), (0, 0))
+        if published_from is not None and start < end:
+            start = bisect_left(self.postings[title_id], published_from, start, end, key=_publication_ts)
+        return start, end
@@ -0,0 +1,71 @@
+import random
+import time
+from pathlib import Path
+
+import spacy
+from spacy.tokens import DocBin
+from spacy.training import biluo_tags_to_spans, offsets_to_biluo_tags
+from spacy.training.example import Example
+from spacy.util import compounding, minibatch
+
+
+def build_corpus(training_data, path: Path, base_model: str = "en_core_web_sm") -> Path:
+    """
+    Serialise the (text, annotations) pairs from create_training_data into a
+    DocBin. Tokens which a misaligned entity only partly covers are marked as
+    missing rather than outside an entity, as Example.from_dict would mark them.
+    """
+    # only the tokenizer is needed, but it should be the base model's
+    nlp = spacy.load(base_model, enable=[])
+    doc_bin = DocBin()
+    for text, annotations in training_data:
+        doc = nlp.make_doc(text)
+        tags = offsets_to_biluo_tags(doc, annotations.get("entities", []))
+        missing = [doc[i : i + 1] for i, tag in enumerate(tags) if tag == "-"]
+        doc.set_ents(biluo_tags_to_spans(doc, tags), missing=missing, default="outside")
+        doc_bin.add(doc)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    doc_bin.to_disk(path)
+    return path
+
+
+def train_ner(
+    corpus_path: Path,
+    output_path: str = "policy_ner_model",
+    base_model: str = "en_core_web_sm",
+    n_epochs: int = 10,
+    dropout: float = 0.5,
+    seed: int = 0,
+):
+    """
+    Fine-tune the base model's NER component on a DocBin corpus, with every other
+    component frozen. The examples are shuffled each epoch and fed to the model
+    in minibatches which grow from 4 to 32 examples.
+    """
+    random.seed(seed)
+    nlp = spacy.load(base_model)
+    nlp.get_pipe("ner").add_label("POLICY")
+
+    # the examples are built once, rather than once per epoch
+    examples = [
+        Example(nlp.make_doc(doc.text), doc)
+        for doc in DocBin().from_disk(corpus_path).get_docs(nlp.vocab)
+    ]
+
+    with nlp.select_pipes(enable=["ner"]):
+        optimizer = nlp.resume_training()
+        for epoch in range(n_epochs):
+            random.shuffle(examples)
+            losses = {}
+            start = time.perf_counter()
+            for batch in minibatch(examples, size=compounding(4.0, 32.0, 1.001)):
+                nlp.update(batch, drop=dropout, sgd=optimizer, losses=losses)
+            elapsed = time.perf_counter() - start
+            print(
+                f"Epoch {epoch + 1}: loss {losses.get('ner', 0.0):.2f}, "
+                f"{elapsed:.1f}s, {len(examples) / elapsed:.0f} examples/sec"
+            )
+
+    nlp.to_disk(output_path)
+    return nlp
@@ -0,0 +1,48 @@
+"""
+Check that the training data made from the mentions is the same whether or not
+the passage store is used.
+"""
+import json
+from pathlib import Path
+
+from src.classifier import create_training_data, get_model_data
+from src.dataset import DATASETS_PATH, DatasetCache
+from src.matching import find_mentions
+from src.mentions import MentionWriter, mention_record
+from src.store import STORE_VERSION, PassageStore, load_passage_store
+from tests.test_matching import shared_id_corpus
+
+
+def test_training_data_is_the_same_with_the_store(tmp_path):
+    corpus = shared_id_corpus(2)
+    mentions = [
+        mention_record(mention) for mention in sorted(find_mentions(corpus, corpus, cross_geography=True))
+    ]
+    # some mentions are of a document which shares its id with an earlier one
+    shared = {(corpus[position].document_id, corpus[position + 1].document_name) for position in range(0, 12, 4)}
+    assert any((mention["document_id_j"], mention["document_name_j"]) in shared for mention in mentions)
+
+    store = load_passage_store(tmp_path, corpus)
+    assert create_training_data(mentions, store) == create_training_data(mentions, None)
+
+
+def test_model_data_ignores_a_stale_store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    corpus = shared_id_corpus(2)
+    DatasetCache.build(DATASETS_PATH / "CPRDocument" / "latest", corpus)
+    with MentionWriter(Path("mentions.jsonl")) as writer:
+        writer.write_all(sorted(find_mentions(corpus, corpus, cross_geography=True)))
+    expected = get_model_data()
+    assert expected
+
+    # a store built from another dataset
+    store_path = Path("data/passages/CPR")
+    PassageStore.build(store_path, corpus[:10])
+    assert get_model_data() == expected
+
+    # a store built by an older version
+    with open(store_path / "index.json") as f:
+        index = json.load(f)
+    with open(store_path / "index.json", "w") as f:
+        json.dump({**index, "version": STORE_VERSION - 1}, f)
+    assert get_model_data() == expected
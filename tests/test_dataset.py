@@ -0,0 +1,83 @@
+"""
+Check which version of the datasets each stage loads, with huggingface replaced
+by a fake which hands out generated corpora.
+"""
+import sys
+import types
+
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from src import linking
+from src.dataset import DATASETS_PATH, DatasetCache, current_version
+
+SIZES = {"v1": 30, None: 50}
+
+
+@pytest.fixture
+def downloads(tmp_path, monkeypatch) -> list:
+    """Work in an empty directory, and record the version of each dataset downloaded."""
+    monkeypatch.chdir(tmp_path)
+    downloaded = []
+
+    class Dataset:
+        def __init__(self, document_type, cdn_domain):
+            self.document_type = document_type
+
+        def from_huggingface(self, version=None):
+            downloaded.append((self.document_type, version))
+            return generate_corpus(SIZES[version], passages_per_document=2, seed=len(downloaded))
+
+    models = types.ModuleType("cpr_data_access.models")
+    models.Dataset = Dataset
+    models.CPRDocument = "CPRDocument"
+    models.GSTDocument = "GSTDocument"
+    package = types.ModuleType("cpr_data_access")
+    package.models = models
+    monkeypatch.setitem(sys.modules, "cpr_data_access", package)
+    monkeypatch.setitem(sys.modules, "cpr_data_access.models", models)
+    return downloaded
+
+
+@pytest.fixture
+def stores(monkeypatch) -> list:
+    """Record the number of documents each passage store is built from."""
+    built = []
+    load_store = linking.load_store
+
+    def record(CPR_data):
+        built.append(len(CPR_data))
+        return load_store(CPR_data)
+
+    monkeypatch.setattr(linking, "load_store", record)
+    return built
+
+
+def test_load_dataset_switches_from_a_pinned_version_back_to_the_latest(downloads, stores):
+    linking.load_dataset("v1")
+    assert current_version() == "v1"
+    assert downloads == [("CPRDocument", "v1"), ("GSTDocument", "v1")]
+    assert len(linking.load_datasets()[0]) == SIZES["v1"]
+
+    downloads.clear()
+    linking.load_dataset()
+    assert current_version() is None
+    assert downloads == [("CPRDocument", None), ("GSTDocument", None)]
+    assert stores == [SIZES["v1"], SIZES[None]]
+    assert len(linking.load_datasets()[0]) == SIZES[None]
+    assert (DATASETS_PATH / "CPRDocument" / "latest" / "columns.json").exists()
+
+
+def test_refresh_downloads_the_latest_again(downloads, stores):
+    linking.load_dataset()
+    linking.load_dataset("v1")
+    downloads.clear()
+
+    linking.load_dataset(refresh=True)
+    assert downloads == [("CPRDocument", None), ("GSTDocument", None)]
+    assert len(DatasetCache(DATASETS_PATH / "CPRDocument" / "latest")) == SIZES[None]
+    # the pinned version is still cached, and is loaded again without a download
+    downloads.clear()
+    linking.load_dataset("v1")
+    assert downloads == []
+    assert stores[-1] == SIZES["v1"]
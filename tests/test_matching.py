@@ -0,0 +1,141 @@
+"""
+Check that the matcher finds exactly the mentions which the original pairwise
+check finds, on small generated corpora.
+
+The baseline functions are copies of the original check_document_geography and
+find_mentions loop, which compared every pair of documents, with the
+cross-geography branch reachable when cross_geography is set.
+"""
+import re
+from typing import Optional
+
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from src.matching import find_mentions, find_mentions_parallel
+from src.store import load_passage_store
+from src.text import update_geography
+
+
+def baseline_normalise_text(input_string: str) -> str:
+    clean_string = re.sub(r"\s+", " ", input_string).strip()
+    clean_string = re.sub(r"[^\x00-\x7F]+", "", clean_string)
+    clean_string = re.sub(r"[^\w\s]", "", clean_string)
+    clean_string = re.sub(r"\([^)]*\)", "", clean_string)
+    return clean_string
+
+
+def baseline_find_title_and_geography(text_blocks, title, geography) -> Optional[str]:
+    norm_title = baseline_normalise_text(title)
+    norm_geography = baseline_normalise_text(geography)
+    for i, text in enumerate(text_blocks):
+        if norm_title in baseline_normalise_text(text):
+            for j in range(max(0, i - 2), min(len(text_blocks), i + 2)):
+                if norm_geography in text_blocks[j]:
+                    return text
+    return None
+
+
+def baseline_check_document_geography(document_i, document_j, cross_geography: bool) -> Optional[str]:
+    title_j = baseline_normalise_text(document_j.document_name)
+    text_blocks = [passage for block in document_i.text_blocks for passage in block.text]
+    geography_j = document_j.document_metadata.geography
+    if geography_j == "nan":
+        geography_j = None
+
+    if document_i.document_metadata.geography_iso == document_j.document_metadata.geography_iso:
+        for passage in text_blocks:
+            if title_j.lower() in baseline_normalise_text(passage).lower():
+                return passage
+    elif cross_geography:
+        if not geography_j:
+            geography_j = update_geography(document_j.document_metadata.geography_iso)
+        if geography_j:
+            return baseline_find_title_and_geography(text_blocks, title_j, geography_j)
+        for passage in text_blocks:
+            if title_j in baseline_normalise_text(passage):
+                return passage
+    return None
+
+
+def baseline_find_mentions(documents, dataset, cross_geography: bool) -> set[tuple[str, str, str, str]]:
+    mentions = set()
+    for document_i in documents:
+        for document_j in dataset:
+            if document_i.document_id == document_j.document_id:
+                continue
+            if document_j.document_metadata.publication_ts < document_i.document_metadata.publication_ts:
+                continue
+            found_block = baseline_check_document_geography(document_i, document_j, cross_geography)
+            if found_block:
+                mentions.add((document_i.document_id, document_j.document_id, document_j.document_name, found_block))
+    return mentions
+
+
+def shared_id_corpus(seed: int) -> list:
+    """A corpus where a few documents share an id with another, different, document."""
+    corpus = generate_corpus(60, passages_per_document=6, mention_rate=0.3, geographies=4, seed=seed)
+    for position in range(0, 12, 4):
+        corpus[position + 1] = corpus[position + 1]._replace(document_id=corpus[position].document_id)
+    return corpus
+
+
+CORPORA = {
+    "seed-0": lambda: generate_corpus(80, passages_per_document=6, mention_rate=0.3, geographies=4, seed=0),
+    "seed-1": lambda: generate_corpus(80, passages_per_document=6, mention_rate=0.3, geographies=6, seed=1),
+    "shared-ids": lambda: shared_id_corpus(2),
+}
+
+
+@pytest.fixture(scope="module", params=list(CORPORA))
+def corpus(request):
+    return CORPORA[request.param]()
+
+
+@pytest.fixture(scope="module")
+def expected(corpus):
+    mentions = {
+        cross_geography: baseline_find_mentions(corpus, corpus, cross_geography)
+        for cross_geography in (False, True)
+    }
+    # the corpora are generated so that both kinds of mention turn up
+    assert mentions[False]
+    assert mentions[True] > mentions[False]
+    return mentions
+
+
+@pytest.fixture(scope="module")
+def store(corpus, tmp_path_factory):
+    return load_passage_store(tmp_path_factory.mktemp("store"), corpus)
+
+
+@pytest.mark.parametrize("cross_geography", [False, True], ids=["same-geography", "cross-geography"])
+def test_find_mentions(corpus, expected, cross_geography):
+    assert find_mentions(corpus, corpus, cross_geography=cross_geography) == expected[cross_geography]
+
+
+@pytest.mark.parametrize("cross_geography", [False, True], ids=["same-geography", "cross-geography"])
+def test_find_mentions_with_store(corpus, expected, store, cross_geography):
+    assert find_mentions(corpus, corpus, store, cross_geography=cross_geography) == expected[cross_geography]
+
+
+@pytest.mark.parametrize("cross_geography", [False, True], ids=["same-geography", "cross-geography"])
+@pytest.mark.parametrize("with_store", [False, True], ids=["without-store", "with-store"])
+def test_find_mentions_parallel(corpus, expected, store, cross_geography, with_store):
+    found = []
+    mentions = find_mentions_parallel(
+        corpus,
+        corpus,
+        store if with_store else None,
+        cross_geography=cross_geography,
+        processes=2,
+        chunk_size=7,
+        on_mentions=found.extend,
+    )
+    assert mentions == expected[cross_geography]
+    assert sorted(found) == sorted(expected[cross_geography])
+
+
+def test_find_mentions_in_part_of_the_dataset(corpus):
+    documents = corpus[::3]
+    assert find_mentions(documents, corpus) == baseline_find_mentions(documents, corpus, cross_geography=False)
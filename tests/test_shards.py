@@ -0,0 +1,82 @@
+"""
+Check that splitting find-mentions into shards, run as separate processes and
+then merged, finds the same mentions as a single run.
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from src.dataset import DatasetCache
+from src.mentions import read_mentions
+from src.shards import shard_info_path
+
+ROOT = Path(__file__).parent.parent
+SHARDS = 3
+
+
+def policies(cwd: Path, *args: str) -> subprocess.Popen:
+    """Start the policies command in cwd, as a separate process."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    return subprocess.Popen(
+        [sys.executable, "-m", "src.cli", *args],
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+
+
+def wait(process: subprocess.Popen) -> str:
+    output, _ = process.communicate(timeout=600)
+    assert process.returncode == 0, output
+    return output
+
+
+@pytest.fixture(scope="module")
+def workspace(tmp_path_factory) -> Path:
+    """A directory with cached datasets in it, as load-dataset leaves them."""
+    path = tmp_path_factory.mktemp("workspace")
+    corpus = generate_corpus(200, passages_per_document=6, mention_rate=0.3, geographies=4, seed=3)
+    DatasetCache.build(path / "data/datasets/CPRDocument/latest", corpus)
+    DatasetCache.build(path / "data/datasets/GSTDocument/latest", corpus[:20])
+    return path
+
+
+def mention_lines(path: Path) -> list[str]:
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def test_merged_shards_match_a_single_run(workspace):
+    wait(policies(workspace, "find-mentions", "--processes", "1"))
+    single = mention_lines(workspace / "mentions.jsonl")
+    assert single
+
+    shards = [
+        policies(workspace, "find-mentions", "--shard", f"{shard}/{SHARDS}", "--processes", "1")
+        for shard in range(SHARDS)
+    ]
+    for shard in shards:
+        wait(shard)
+    wait(policies(workspace, "merge-shards", str(SHARDS), "--skip-graph"))
+    merged = mention_lines(workspace / "mentions.jsonl")
+
+    assert len(merged) == len(set(merged))
+    assert sorted(merged) == sorted(single)
+    # every shard found some of the mentions, so the documents really were split between them
+    for shard in range(SHARDS):
+        assert list(read_mentions(workspace / "data/shards" / f"mentions-{shard}-of-{SHARDS}.jsonl"))
+
+
+def test_merge_needs_every_shard(workspace):
+    (workspace / shard_info_path(1, SHARDS)).unlink(missing_ok=True)
+    process = policies(workspace, "merge-shards", str(SHARDS), "--skip-graph")
+    output, _ = process.communicate(timeout=600)
+    assert process.returncode != 0
+    assert "haven't finished" in output